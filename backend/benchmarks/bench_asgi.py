@@ -0,0 +1,122 @@
+'''
+Compares concurrent-request throughput of the WSGI app (a thread per
+in-flight request, as under a threaded WSGI server) and the ASGI app of
+flaskr/asgi.py (requests from an asyncio client), in process:
+
+    python benchmarks/bench_asgi.py [--database URL] [--concurrency 64]
+                                    [--requests 2000] [--questions 20000]
+'''
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import percentile
+from common import seed_questions
+
+from flaskr import create_app
+from flaskr.asgi import AsgiApp
+
+PATHS = (
+    ('GET', '/categories', b''),
+    ('GET', '/questions', b'page=2'),
+    ('GET', '/categories/3/questions', b''),
+    ('POST', '/quizzes', b'{"previous_questions": [1, 2, 3]}'),
+    )
+
+
+def bench_wsgi(app, concurrency, requests):
+    def fetch(number):
+        method, path, body = PATHS[number % len(PATHS)]
+        client = app.test_client()
+        started = time.perf_counter()
+        response = client.open(
+            path, method=method, data=body,
+            content_type='application/json')
+        return time.perf_counter() - started, response.status_code
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        started = time.perf_counter()
+        results = list(executor.map(fetch, range(requests)))
+        return time.perf_counter() - started, results
+
+
+def bench_asgi(app, concurrency, requests):
+    asgi_app = AsgiApp(app.wsgi_app, concurrency)
+
+    async def fetch(number):
+        method, path, body = PATHS[number % len(PATHS)]
+        query_string = b''
+        if path == '/questions':
+            query_string, body = body, b''
+        messages = [{'type': 'http.request', 'body': body}]
+        status = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        started = time.perf_counter()
+        await asgi_app({
+            'type': 'http', 'method': method, 'path': path,
+            'query_string': query_string,
+            'headers': [(b'content-type', b'application/json')]},
+            receive, send)
+        return time.perf_counter() - started, status[0]
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(number):
+            async with semaphore:
+                return await fetch(number)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(limited(number) for number in range(requests)))
+        return time.perf_counter() - started, results
+
+    return asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--questions', type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = args.database
+        if database is None:
+            database = 'sqlite:///' + os.path.join(directory, 'bench.db')
+
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': database,
+            'RESPONSE_CACHE_SIZE': 0
+            })
+        if args.database is None:
+            with app.app_context():
+                seed_questions(args.questions)
+
+        print('{:<6} {:>11} {:>8} {:>8} {:>7}'.format(
+            'app', 'requests/s', 'p50 ms', 'p99 ms', 'errors'))
+        for name, bench in (('wsgi', bench_wsgi), ('asgi', bench_asgi)):
+            bench(app, args.concurrency, len(PATHS) * 4)
+            elapsed, results = bench(app, args.concurrency, args.requests)
+            latencies = [latency for latency, _ in results]
+            print('{:<6} {:>11.0f} {:>8.2f} {:>8.2f} {:>7}'.format(
+                name, args.requests / elapsed,
+                percentile(latencies, 0.50) * 1000,
+                percentile(latencies, 0.99) * 1000,
+                sum(1 for _, status in results if status != 200)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+'''
+Benchmarks every route at several sizes of the question bank, through
+the Flask test client and through a real WSGI server (werkzeug's, on a
+local port), and reports p50/p99 latency, throughput and peak memory per
+route as JSON:
+
+    python benchmarks/bench_endpoints.py [--sizes 1000,100000,1000000]
+                                         [--drivers client,wsgi]
+                                         [--requests 200] [--output FILE]
+                                         [--baseline FILE] [--save-baseline]
+                                         [--tolerance 0.5] [--database URL]
+                                         [--question-store]
+
+Every size gets a throwaway SQLite database filled with the synthetic
+questions of flaskr/synthetic.py (seed 0); with --database the routes
+run against that database as it is, as a single size. The response cache
+is disabled so that every request reaches the routes. --question-store
+serves the routes from a shared question store (flaskr/store.py) in the
+temporary directory.
+
+Results are compared with the baseline (benchmarks/baseline.json by
+default, when it exists): a route whose p50 or p99 latency or peak memory
+grew, or whose throughput dropped, by more than the tolerance is reported
+and the run exits with status 1. --save-baseline writes the results as the
+new baseline; baselines only compare runs on the same machine.
+'''
+import argparse
+import http.client
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from common import percentile
+
+from werkzeug.serving import WSGIRequestHandler
+from werkzeug.serving import make_server
+
+from flaskr import create_app
+from flaskr.synthetic import generate_questions
+from models import Question
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baseline.json')
+
+# latency changes below this many milliseconds are noise, not regressions
+MIN_LATENCY_DELTA_MS = 0.2
+
+MEMORY_REQUESTS = 20
+
+QUIZ = {
+    'previous_questions': [1, 2, 3],
+    'quiz_category': {'id': 1, 'type': 'Science'}
+    }
+
+'''
+routes(size)
+    the benchmarked requests as (name, method, path, JSON body) for a
+    question bank of `size` questions; create_question also deletes the
+    question it created, so that repeated runs leave the data unchanged.
+'''
+
+
+def routes(size):
+    last_page = max((size + 9) // 10, 1)
+    return [
+        ('get_categories', 'GET', '/categories', None),
+        ('get_questions', 'GET', '/questions?page=2', None),
+        ('get_questions_last_page', 'GET',
+         '/questions?page={}'.format(last_page), None),
+        ('get_questions_after_id', 'GET',
+         '/questions?after_id={}'.format(size // 2), None),
+        ('get_category_questions', 'GET', '/categories/3/questions', None),
+        ('search_questions', 'POST', '/questions',
+         {'searchTerm': 'river'}),
+        ('play_quiz', 'POST', '/quizzes', QUIZ),
+        ('create_question', 'POST', '/questions', {
+            'question': 'Benchmark question?',
+            'answer': 'Benchmark answer',
+            'category': 1,
+            'difficulty': 1})
+        ]
+
+
+class ClientDriver:
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body):
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+    def close(self):
+        pass
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class WsgiDriver:
+
+    def __init__(self, app):
+        self.server = make_server(
+            '127.0.0.1', 0, app, threaded=True,
+            request_handler=QuietRequestHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self, method, path, body):
+        connection = http.client.HTTPConnection(
+            '127.0.0.1', self.server.server_port)
+        try:
+            connection.request(
+                method, path,
+                body=json.dumps(body) if body is not None else None,
+                headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            data = response.read()
+        finally:
+            connection.close()
+        try:
+            return response.status, json.loads(data)
+        except ValueError:
+            return response.status, None
+
+    def close(self):
+        self.server.shutdown()
+        self.thread.join()
+
+
+DRIVERS = {'client': ClientDriver, 'wsgi': WsgiDriver}
+
+
+def send(driver, method, path, body):
+    status, data = driver.request(method, path, body)
+    if path == '/questions' and body and 'question' in body and data:
+        driver.request(
+            'DELETE', '/questions/{}'.format(data['created']), None)
+    return status
+
+
+def bench_route(driver, method, path, body, requests):
+    for _ in range(5):
+        send(driver, method, path, body)
+
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        request_started = time.perf_counter()
+        status = send(driver, method, path, body)
+        latencies.append(time.perf_counter() - request_started)
+        errors += status != 200
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    for _ in range(MEMORY_REQUESTS):
+        send(driver, method, path, body)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'requests_per_second': round(requests / elapsed, 1),
+        'peak_memory_kb': round(peak / 1024, 1),
+        'errors': errors
+        }
+
+
+def bench_size(database, size, drivers, requests, seed, store=None):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': database,
+        'RESPONSE_CACHE_SIZE': 0,
+        'QUESTION_STORE': store or ''
+        })
+    with app.app_context():
+        if seed:
+            generate_questions(size)
+        size = Question.query.count()
+
+    results = {}
+    for driver_name in drivers:
+        driver = DRIVERS[driver_name](app)
+        try:
+            results[driver_name] = {
+                name: bench_route(driver, method, path, body, requests)
+                for name, method, path, body in routes(size)}
+        finally:
+            driver.close()
+    return size, results
+
+
+'''
+compare(results, baseline, tolerance)
+    lists the measurements of `results` that are worse than those of
+    `baseline` by more than `tolerance` (a fraction).
+'''
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for size, drivers in results.items():
+        for driver, route_results in drivers.items():
+            for route, current in route_results.items():
+                previous = (baseline.get(size, {}).get(driver, {})
+                            .get(route))
+                if previous is None:
+                    continue
+
+                where = '{} {} {}'.format(size, driver, route)
+                for key in ('p50_ms', 'p99_ms'):
+                    if (current[key] > previous[key] * (1 + tolerance) and
+                            current[key] - previous[key] >
+                            MIN_LATENCY_DELTA_MS):
+                        regressions.append('{} {}: {} -> {}'.format(
+                            where, key, previous[key], current[key]))
+                if current['peak_memory_kb'] > \
+                        previous['peak_memory_kb'] * (1 + tolerance):
+                    regressions.append('{} peak_memory_kb: {} -> {}'.format(
+                        where, previous['peak_memory_kb'],
+                        current['peak_memory_kb']))
+                if current['requests_per_second'] < \
+                        previous['requests_per_second'] / (1 + tolerance):
+                    regressions.append(
+                        '{} requests_per_second: {} -> {}'.format(
+                            where, previous['requests_per_second'],
+                            current['requests_per_second']))
+                if current['errors'] > previous['errors']:
+                    regressions.append('{} errors: {} -> {}'.format(
+                        where, previous['errors'], current['errors']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,100000')
+    parser.add_argument('--drivers', default='client,wsgi')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--database')
+    parser.add_argument('--output')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    parser.add_argument('--question-store', action='store_true')
+    args = parser.parse_args()
+
+    drivers = args.drivers.split(',')
+
+    def store(directory, name):
+        if not args.question_store:
+            return None
+        return os.path.join(directory, 'questions-{}.store'.format(name))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        if args.database:
+            size, results_of_size = bench_size(
+                args.database, 0, drivers, args.requests, seed=False,
+                store=store(directory, 'database'))
+            results[str(size)] = results_of_size
+        for size in [] if args.database else args.sizes.split(','):
+            database = 'sqlite:///' + os.path.join(
+                directory, 'bench-{}.db'.format(size))
+            _, results[size] = bench_size(
+                database, int(size), drivers, args.requests, seed=True,
+                store=store(directory, size))
+
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.node(),
+        'requests': args.requests,
+        'results': results
+        }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text)
+    print(text)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as output:
+            output.write(text)
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline:
+            regressions = compare(
+                results, json.load(baseline)['results'], args.tolerance)
+        for regression in regressions:
+            print('regression: ' + regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+'''
+Compares the ORM read path (Question instances + format()) against the
+QuestionRow projection used by the read endpoints, per request, on a
+throwaway SQLite database:
+
+    python benchmarks/bench_read_path.py [--questions 20000] [--rounds 200]
+
+Reports CPU time and allocated bytes per request for a page of
+QUESTIONS_PER_PAGE questions and for a dump of 1000 questions.
+'''
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from common import seed_questions
+
+from flask import Flask
+
+from models import setup_db
+from models import db
+from models import Question
+from models import QuestionRow
+from flaskr.pagination import QUESTIONS_PER_PAGE
+
+
+def orm_path(limit):
+    questions = Question.query.order_by(Question.id).limit(limit).all()
+    result = [question.format() for question in questions]
+    db.session.remove()
+    return result
+
+
+def projection_path(limit):
+    rows = QuestionRow.query().order_by(Question.id).limit(limit).all()
+    result = [QuestionRow(*row).format() for row in rows]
+    db.session.remove()
+    return result
+
+
+def measure(path, limit, rounds):
+    path(limit)
+
+    started = time.process_time()
+    for _ in range(rounds):
+        path(limit)
+    cpu = (time.process_time() - started) / rounds
+
+    tracemalloc.start()
+    path(limit)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return cpu, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--questions', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = Flask(__name__)
+        setup_db(app, 'sqlite:///' + os.path.join(directory, 'bench.db'))
+
+        with app.app_context():
+            seed_questions(args.questions)
+
+            print('{:<12} {:>6} {:>14} {:>14}'.format(
+                'path', 'rows', 'cpu/request', 'peak alloc'))
+            for limit in (QUESTIONS_PER_PAGE, 1000):
+                for name, path in (('orm', orm_path),
+                                   ('projection', projection_path)):
+                    cpu, peak = measure(path, limit, args.rounds)
+                    print('{:<12} {:>6} {:>11.1f} us {:>11.1f} KB'.format(
+                        name, limit, cpu * 1e6, peak / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+'''
+Compares the JSON encodings of typical response bodies: payload size and
+CPU time per response, for every serializer of flaskr/serialization.py,
+for the object and column shapes of question lists, plain and compressed:
+
+    python benchmarks/bench_serialization.py [--rounds 200]
+
+The bodies are built from synthetic questions (flaskr/synthetic.py, seed
+0): a page of /questions, a listing of 1000 questions and a quiz
+question. "flask" is what flask.jsonify wrote before (the standard
+encoder with sorted keys, pretty-printed in debug mode as "flask-debug").
+orjson and brotli are measured when installed.
+'''
+import argparse
+import gzip
+import json
+import time
+
+import common  # noqa: F401 (puts the backend on sys.path)
+
+from flask import Flask
+
+from flaskr.serialization import BROTLI_QUALITY
+from flaskr.serialization import GZIP_LEVEL
+from flaskr.serialization import QUESTION_FIELDS
+from flaskr.serialization import SERIALIZERS
+from flaskr.serialization import brotli
+from flaskr.synthetic import CATEGORY_TYPES
+from flaskr.synthetic import QuestionGenerator
+
+
+def questions(count):
+    generator = QuestionGenerator(range(1, len(CATEGORY_TYPES) + 1))
+    return [dict(row, id=number)
+            for number, row in enumerate(generator.rows(count), 1)]
+
+
+def columns(rows):
+    return {field: [row[field] for row in rows] for field in QUESTION_FIELDS}
+
+
+def bodies():
+    categories = dict(enumerate(CATEGORY_TYPES, 1))
+    page = questions(10)
+    listing = questions(1000)
+    quiz = questions(1)[0]
+
+    def listing_body(rows, shape):
+        return {
+            'success': True,
+            'questions': rows if shape == 'objects' else columns(rows),
+            'total_questions': 100000,
+            'next_after_id': rows[-1]['id'],
+            'categories': categories,
+            'current_category': categories
+            }
+
+    return [
+        ('page', 'objects', listing_body(page, 'objects')),
+        ('page', 'columns', listing_body(page, 'columns')),
+        ('listing_1000', 'objects', listing_body(listing, 'objects')),
+        ('listing_1000', 'columns', listing_body(listing, 'columns')),
+        ('quiz', 'objects', {'success': True, 'question': quiz}),
+        ]
+
+
+def timed(function, rounds):
+    started = time.process_time()
+    for _ in range(rounds):
+        result = function()
+    return result, (time.process_time() - started) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    encoders = {
+        'flask': lambda data: json.dumps(
+            data, sort_keys=True, separators=(',', ':')).encode(),
+        'flask-debug': lambda data: json.dumps(
+            data, sort_keys=True, indent=2, separators=(', ', ': ')).encode()
+        }
+    for name, serializer in SERIALIZERS.items():
+        encoders[name] = (
+            lambda serializer: lambda data: serializer(data, True))(
+                serializer)
+
+    compressors = [('gzip', lambda body: gzip.compress(body, GZIP_LEVEL))]
+    if brotli is not None:
+        compressors.append((
+            'br', lambda body: brotli.compress(body, quality=BROTLI_QUALITY)))
+
+    print('{:<13} {:<8} {:<12} {:>9} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(
+        'body', 'shape', 'encoder', 'bytes', 'us', 'gzip B', 'gzip us',
+        'br B', 'br us'))
+    with Flask(__name__).app_context():
+        for body_name, shape, data in bodies():
+            for encoder_name, encode in encoders.items():
+                body, seconds = timed(lambda: encode(data), args.rounds)
+                cells = [len(body), seconds * 1e6]
+                for _, compress in compressors:
+                    compressed, seconds = timed(
+                        lambda: compress(body), args.rounds)
+                    cells += [len(compressed), seconds * 1e6]
+                cells += [0, 0] * (2 - len(compressors))
+                print('{:<13} {:<8} {:<12} {:>9} {:>9.1f} {:>9} {:>9.1f} '
+                      '{:>9} {:>9.1f}'.format(
+                          body_name, shape, encoder_name, *cells))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+'''
+Measures application startup: the time create_app takes, the SQL
+statements it runs, and the time to the first response, for the startup
+modes of flaskr/startup.py:
+
+    python benchmarks/bench_startup.py [--runs 20] [--questions 10000]
+                                       [--database URL] [--output FILE]
+                                       [--baseline FILE] [--save-baseline]
+                                       [--tolerance 0.5]
+
+    eager      the schema is checked while the app is created (default)
+    lazy       LAZY_DB_INIT: the schema is checked by the first request
+    lazy_warm  LAZY_DB_INIT and WARM_CACHES: a background thread checks
+               the schema and loads the caches right after startup
+
+The first request is a quiz question, which needs the categories and the
+quiz sampler. Every run creates a new app against the same database (a
+throwaway SQLite database with the synthetic questions of
+flaskr/synthetic.py, or --database as it is), whose schema marker is
+already written, like a restarting worker.
+
+Results are compared with the baseline (benchmarks/startup_baseline.json
+by default, when it exists) as in bench_endpoints.py: slower medians or
+more statements during create_app are reported and exit with status 1.
+'''
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from common import percentile
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from flaskr import create_app
+from flaskr.synthetic import generate_questions
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'startup_baseline.json')
+
+# changes below this many milliseconds are noise, not regressions
+MIN_DELTA_MS = 1.0
+
+MODES = {
+    'eager': {},
+    'lazy': {'LAZY_DB_INIT': True},
+    'lazy_warm': {'LAZY_DB_INIT': True, 'WARM_CACHES': True}
+    }
+
+QUIZ = {
+    'previous_questions': [],
+    'quiz_category': {'id': 1, 'type': 'Science'}
+    }
+
+statements = []
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_statement(connection, cursor, statement, parameters, context,
+                    executemany):
+    statements.append(statement)
+
+
+def bench_mode(database, config, runs):
+    create_times = []
+    create_statements = []
+    first_response_times = []
+    warm_times = []
+    errors = 0
+
+    for _ in range(runs):
+        del statements[:]
+        started = time.perf_counter()
+        app = create_app(dict(config, SQLALCHEMY_DATABASE_URI=database))
+        create_times.append(time.perf_counter() - started)
+        create_statements.append(len(statements))
+
+        response = app.test_client().post('/quizzes', json=QUIZ)
+        first_response_times.append(time.perf_counter() - started)
+        errors += response.status_code != 200
+
+        thread = app.extensions.get('warm_thread')
+        if thread is not None:
+            thread.join()
+            warm_times.append(app.extensions['startup_timings']['warm'])
+
+    def milliseconds(values, fraction):
+        return round(percentile(values, fraction) * 1000, 3)
+
+    result = {
+        'create_app_p50_ms': milliseconds(create_times, 0.5),
+        'create_app_max_ms': milliseconds(create_times, 1.0),
+        'create_app_statements': max(create_statements),
+        'first_response_p50_ms': milliseconds(first_response_times, 0.5),
+        'first_response_max_ms': milliseconds(first_response_times, 1.0),
+        'errors': errors
+        }
+    if warm_times:
+        result['warm_p50_ms'] = milliseconds(warm_times, 0.5)
+    return result
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for mode, current in results.items():
+        previous = baseline.get(mode)
+        if previous is None:
+            continue
+        for key in ('create_app_p50_ms', 'first_response_p50_ms'):
+            if (current[key] > previous[key] * (1 + tolerance) and
+                    current[key] - previous[key] > MIN_DELTA_MS):
+                regressions.append('{} {}: {} -> {}'.format(
+                    mode, key, previous[key], current[key]))
+        for key in ('create_app_statements', 'errors'):
+            if current[key] > previous[key]:
+                regressions.append('{} {}: {} -> {}'.format(
+                    mode, key, previous[key], current[key]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--questions', type=int, default=10000)
+    parser.add_argument('--database')
+    parser.add_argument('--output')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = args.database
+        if database is None:
+            database = 'sqlite:///' + os.path.join(directory, 'startup.db')
+            with create_app({'SQLALCHEMY_DATABASE_URI': database}) \
+                    .app_context():
+                generate_questions(args.questions)
+
+        results = {
+            mode: bench_mode(database, config, args.runs)
+            for mode, config in MODES.items()}
+
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.node(),
+        'runs': args.runs,
+        'results': results
+        }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text)
+    print(text)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as output:
+            output.write(text)
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline:
+            regressions = compare(
+                results, json.load(baseline)['results'], args.tolerance)
+        for regression in regressions:
+            print('regression: ' + regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
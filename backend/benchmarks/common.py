@@ -0,0 +1,41 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db
+from models import Question
+from models import Category
+
+CATEGORIES = (
+    'Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports')
+
+
+'''
+seed_questions(count)
+    fills an empty database with the categories of trivia.psql and
+    `count` simple questions spread evenly over them.
+'''
+
+
+def seed_questions(count):
+    if not Category.query.count():
+        db.session.execute(Category.__table__.insert(), [
+            {'id': number, 'type': category_type}
+            for number, category_type in enumerate(CATEGORIES, 1)])
+
+    for start in range(0, count, 10000):
+        db.session.execute(Question.__table__.insert(), [
+            {'question': 'Question {}?'.format(number),
+             'answer': 'Answer {}'.format(number),
+             'category': number % len(CATEGORIES) + 1,
+             'difficulty': number % 5 + 1}
+            for number in range(start, min(start + 10000, count))])
+    db.session.commit()
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
@@ -0,0 +1,282 @@
+'''
+Load test with simulated quiz players, to find how many concurrent
+players one node sustains:
+
+    python benchmarks/load_players.py [--processes 4] [--players 64]
+                                      [--duration 30] [--think-ms 0]
+                                      [--questions 20000] [--database URL]
+                                      [--server-processes 1] [--url URL]
+                                      [--seed 0] [--output FILE]
+
+A local server is started in its own process (werkzeug's, threaded, or
+forking with --server-processes > 1) against a throwaway SQLite database
+with the synthetic questions of flaskr/synthetic.py, or against --database
+as it is; --url targets a server that is already running instead, for
+example gunicorn. The players are spread over --processes load generator
+processes, each running its share of them as threads, so that the load
+generators don't share one interpreter lock.
+
+Every player loops over sessions like the frontend's until --duration is
+over: it fetches the categories, plays a quiz of QUIZ_LENGTH questions in
+a random category through POST /quizzes with a growing
+previous_questions, searches for a word, and browses a random page of the
+questions and of the category, pausing --think-ms between requests. The
+report gives requests, errors, error rate, throughput and latency
+percentiles per endpoint, and the completed sessions, as a table and as
+JSON with --output.
+'''
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+from common import percentile
+
+from werkzeug.serving import WSGIRequestHandler
+from werkzeug.serving import make_server
+
+from flaskr import create_app
+from flaskr.synthetic import WORDS
+from flaskr.synthetic import generate_questions
+
+QUIZ_LENGTH = 5
+PAGE_SIZE = 10
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def serve(database, processes, ports):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database})
+    server = make_server(
+        '127.0.0.1', 0, app, threaded=processes == 1, processes=processes,
+        request_handler=QuietRequestHandler)
+    ports.put(server.server_port)
+    server.serve_forever()
+
+
+class Player:
+
+    def __init__(self, host, port, rng, think_seconds, stats):
+        self.host = host
+        self.port = port
+        self.rng = rng
+        self.think_seconds = think_seconds
+        self.stats = stats
+
+    def request(self, endpoint, method, path, body=None):
+        connection = http.client.HTTPConnection(self.host, self.port)
+        started = time.perf_counter()
+        try:
+            connection.request(
+                method, path,
+                body=json.dumps(body) if body is not None else None,
+                headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            status = response.status
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            status, data = None, b''
+        finally:
+            connection.close()
+
+        stats = self.stats.setdefault(
+            endpoint, {'latencies': [], 'errors': 0})
+        stats['latencies'].append(time.perf_counter() - started)
+        if status != 200:
+            stats['errors'] += 1
+
+        if self.think_seconds:
+            time.sleep(self.think_seconds)
+        try:
+            return json.loads(data) if status == 200 else None
+        except ValueError:
+            return None
+
+    def session(self):
+        data = self.request('GET /categories', 'GET', '/categories')
+        categories = (data or {}).get('categories') or {'0': 'All'}
+        category_id = self.rng.choice(sorted(categories) + ['0'])
+        quiz_category = {
+            'id': int(category_id),
+            'type': categories.get(category_id, 'All')}
+
+        previous_questions = []
+        for _ in range(QUIZ_LENGTH):
+            data = self.request('POST /quizzes', 'POST', '/quizzes', {
+                'previous_questions': previous_questions,
+                'quiz_category': quiz_category})
+            question = (data or {}).get('question')
+            if not question:
+                break
+            previous_questions.append(question['id'])
+
+        self.request('POST /questions (search)', 'POST', '/questions', {
+            'searchTerm': self.rng.choice(WORDS)})
+
+        data = self.request('GET /questions', 'GET', '/questions?page=1')
+        pages = max(((data or {}).get('total_questions', 0) + PAGE_SIZE - 1)
+                    // PAGE_SIZE, 1)
+        self.request('GET /questions', 'GET', '/questions?page={}'.format(
+            self.rng.randint(1, pages)))
+
+        if category_id != '0':
+            self.request(
+                'GET /categories/<id>/questions', 'GET',
+                '/categories/{}/questions'.format(category_id))
+
+
+'''
+run_players(url, players, duration, think_ms, seed)
+    runs `players` players as threads of this process for `duration`
+    seconds and returns the latencies and errors of every endpoint and
+    the number of completed sessions.
+'''
+
+
+def run_players(url, players, duration, think_ms, seed):
+    address = urlsplit(url)
+    deadline = time.monotonic() + duration
+    results = []
+
+    def play(number):
+        stats = {}
+        player = Player(address.hostname, address.port,
+                        random.Random(seed * 100003 + number),
+                        think_ms / 1000, stats)
+        sessions = 0
+        while time.monotonic() < deadline:
+            player.session()
+            sessions += 1
+        results.append((stats, sessions))
+
+    threads = [threading.Thread(target=play, args=(number,))
+               for number in range(players)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    merged = {}
+    for stats, _ in results:
+        for endpoint, endpoint_stats in stats.items():
+            total = merged.setdefault(endpoint, {'latencies': [], 'errors': 0})
+            total['latencies'].extend(endpoint_stats['latencies'])
+            total['errors'] += endpoint_stats['errors']
+    return merged, sum(sessions for _, sessions in results)
+
+
+def summarize(results, elapsed):
+    endpoints = {}
+    for stats, _ in results:
+        for endpoint, endpoint_stats in stats.items():
+            total = endpoints.setdefault(
+                endpoint, {'latencies': [], 'errors': 0})
+            total['latencies'].extend(endpoint_stats['latencies'])
+            total['errors'] += endpoint_stats['errors']
+
+    summary = {}
+    for endpoint, stats in sorted(endpoints.items()):
+        latencies = stats['latencies']
+        summary[endpoint] = {
+            'requests': len(latencies),
+            'errors': stats['errors'],
+            'error_rate': round(stats['errors'] / len(latencies), 4),
+            'requests_per_second': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p90_ms': round(percentile(latencies, 0.90) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'max_ms': round(max(latencies) * 1000, 2)
+            }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--players', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--think-ms', type=float, default=0)
+    parser.add_argument('--questions', type=int, default=20000)
+    parser.add_argument('--database')
+    parser.add_argument('--server-processes', type=int, default=1)
+    parser.add_argument('--url')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = None
+        url = args.url
+        if url is None:
+            database = args.database
+            if database is None:
+                database = 'sqlite:///' + os.path.join(directory, 'load.db')
+                with create_app({'SQLALCHEMY_DATABASE_URI': database}) \
+                        .app_context():
+                    generate_questions(args.questions, args.seed)
+
+            ports = multiprocessing.Queue()
+            server = multiprocessing.Process(
+                target=serve,
+                args=(database, args.server_processes, ports), daemon=True)
+            server.start()
+            url = 'http://127.0.0.1:{}'.format(ports.get(timeout=60))
+
+        # players are dealt round-robin, so that every process gets its
+        # share even when they don't divide evenly
+        shares = [len(range(number, args.players, args.processes))
+                  for number in range(args.processes)]
+        try:
+            with multiprocessing.Pool(args.processes) as pool:
+                started = time.perf_counter()
+                results = pool.starmap(run_players, [
+                    (url, players, args.duration, args.think_ms,
+                     args.seed * 1000 + number)
+                    for number, players in enumerate(shares) if players])
+                elapsed = time.perf_counter() - started
+        finally:
+            if server is not None:
+                server.terminate()
+                server.join()
+
+    summary = summarize(results, elapsed)
+    report = {
+        'url': args.url or 'local',
+        'processes': args.processes,
+        'players': args.players,
+        'duration_seconds': round(elapsed, 1),
+        'think_ms': args.think_ms,
+        'sessions': sum(sessions for _, sessions in results),
+        'requests_per_second': round(sum(
+            stats['requests'] for stats in summary.values()) / elapsed, 1),
+        'endpoints': summary
+        }
+
+    print('{:<32} {:>9} {:>7} {:>9} {:>8} {:>8} {:>8}'.format(
+        'endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p90 ms',
+        'p99 ms'))
+    for endpoint, stats in summary.items():
+        print('{:<32} {:>9} {:>7} {:>9.1f} {:>8.2f} {:>8.2f} {:>8.2f}'.format(
+            endpoint, stats['requests'], stats['errors'],
+            stats['requests_per_second'], stats['p50_ms'], stats['p90_ms'],
+            stats['p99_ms']))
+    print('{} players, {} sessions, {:.1f} requests/s'.format(
+        args.players, report['sessions'], report['requests_per_second']))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+'''
+Load test of GET /questions with and without connection pooling:
+
+    python benchmarks/load_pooling.py [--database URL] [--threads 16]
+                                      [--requests 2000] [--questions 20000]
+
+Without --database a throwaway SQLite database is seeded; pass the URL of
+a Postgres database (e.g. one restored from trivia.psql) to measure the
+cost of opening a connection per request for real. The response cache is
+disabled so that every request reaches the database.
+'''
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import percentile
+from common import seed_questions
+
+from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import QueuePool
+
+from flaskr import create_app
+
+
+def run(database, options, threads, requests, pages):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': database,
+        'SQLALCHEMY_ENGINE_OPTIONS': options,
+        'RESPONSE_CACHE_SIZE': 0
+        })
+
+    def fetch(number):
+        client = app.test_client()
+        started = time.perf_counter()
+        response = client.get('/questions?page={}'.format(number % pages + 1))
+        return time.perf_counter() - started, response.status_code
+
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(fetch, range(threads)))
+        started = time.perf_counter()
+        results = list(executor.map(fetch, range(requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies = [latency for latency, _ in results]
+    return {
+        'requests/s': requests / elapsed,
+        'p50 ms': percentile(latencies, 0.50) * 1000,
+        'p99 ms': percentile(latencies, 0.99) * 1000,
+        'errors': sum(1 for _, status in results if status != 200),
+        'connects': app.extensions['pool_metrics']['connects']
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--questions', type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = args.database
+        if database is None:
+            database = 'sqlite:///' + os.path.join(directory, 'load.db')
+            with create_app({'SQLALCHEMY_DATABASE_URI': database}) \
+                    .app_context():
+                seed_questions(args.questions)
+
+        pooled = {
+            'poolclass': QueuePool,
+            'pool_size': args.threads,
+            'max_overflow': 0,
+            'pool_pre_ping': True
+            }
+        if database.startswith('sqlite'):
+            # pooled SQLite connections move between threads
+            pooled['connect_args'] = {'check_same_thread': False}
+
+        modes = (('pooled', pooled), ('unpooled', {'poolclass': NullPool}))
+
+        print('{:<10} {:>11} {:>8} {:>8} {:>7} {:>9}'.format(
+            'mode', 'requests/s', 'p50 ms', 'p99 ms', 'errors', 'connects'))
+        for name, options in modes:
+            result = run(database, options, args.threads, args.requests, 50)
+            print('{:<10} {:>11.0f} {:>8.2f} {:>8.2f} {:>7} {:>9}'.format(
+                name, result['requests/s'], result['p50 ms'],
+                result['p99 ms'], result['errors'], result['connects']))
+
+
+if __name__ == '__main__':
+    main()
@@ -18,3 +18,49 @@ db_host = os.environ.get('db_host')
 db_port = os.environ.get('db_port')
 db_test_name = os.environ.get('db_test_name')
 db_name = os.environ.get('db_name')
+
+# Connection pooling, per worker process.
+# With db_max_connections set, the pool of every worker gets an equal share
+# of it (WEB_CONCURRENCY is the number of gunicorn workers) and no overflow.
+# db_external_pooler=true is for running behind pgbouncer and the like:
+# no pool is kept in the app, and statement_timeout has to be set on the
+# database role instead of per connection.
+web_concurrency = int(os.environ.get('WEB_CONCURRENCY', 1))
+db_max_connections = int(os.environ.get('db_max_connections', 0))
+db_pool_size = int(os.environ.get('db_pool_size', 5))
+db_max_overflow = int(os.environ.get('db_max_overflow', 10))
+if db_max_connections:
+    db_pool_size = max(db_max_connections // web_concurrency, 1)
+    db_max_overflow = 0
+db_pool_timeout = int(os.environ.get('db_pool_timeout', 30))
+db_pool_recycle = int(os.environ.get('db_pool_recycle', 1800))
+db_pool_pre_ping = os.environ.get('db_pool_pre_ping', 'true') == 'true'
+db_external_pooler = os.environ.get('db_external_pooler', 'false') == 'true'
+
+# Milliseconds, 0 disables the timeout.
+db_statement_timeout = int(os.environ.get('db_statement_timeout', 0))
+
+# TCP keepalives, so that dropped connections are noticed (seconds).
+db_keepalives_idle = int(os.environ.get('db_keepalives_idle', 60))
+db_keepalives_interval = int(os.environ.get('db_keepalives_interval', 10))
+db_keepalives_count = int(os.environ.get('db_keepalives_count', 5))
+
+# Request instrumentation (Server-Timing header and GET /metrics), and
+# profiling of a sample of requests; profiles of requests slower than
+# profile_slow_ms are written to profile_dir.
+instrumentation = os.environ.get('instrumentation', 'false') == 'true'
+profile_sample_rate = float(os.environ.get('profile_sample_rate', 0))
+profile_slow_ms = int(os.environ.get('profile_slow_ms', 500))
+profile_dir = os.environ.get('profile_dir', '')
+
+# Startup: with lazy_db_init=true the schema check is deferred from app
+# creation to the first request; with warm_caches=true every worker loads
+# its in-memory caches and indexes in a background thread after startup,
+# instead of on the first request that needs them.
+lazy_db_init = os.environ.get('lazy_db_init', 'false') == 'true'
+warm_caches = os.environ.get('warm_caches', 'false') == 'true'
+
+# Shared question store: path of the snapshot file which the workers of a
+# host map into memory to serve the question listings and quizzes without
+# the database (see flaskr/store.py); empty disables it.
+question_store = os.environ.get('question_store', '')
@@ -1,34 +1,67 @@
-import os
+import time
 from flask import Flask
 from flask import request
 from flask import abort
-from flask import jsonify
+from flask import Response
+from flask import stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
 
+from models import db
 from models import setup_db
+from models import database_path
 from models import Question
-from models import Category
-
-QUESTIONS_PER_PAGE = 10
+from models import cached_categories
+
+from .pagination import paginate_questions
+from .pagination import count_questions
+from .stats import category_summary
+from .batch import BATCH_MAX_SIZE
+from .batch import create_questions
+from .batch import delete_questions
+from .validation import validate_question
+from .quiz import QUIZ_MAX_COUNT
+from .quiz import random_questions
+from .search import search_questions
+from .cache import init_response_cache
+from .cache import cached_response
+from .cache import category_group
+from .bulk import IMPORT_BATCH_SIZE
+from .bulk import IMPORT_MAX_BATCH_SIZE
+from .bulk import read_rows
+from .bulk import import_questions
+from .bulk import export_questions
+from .bulk import init_bulk_commands
+from .suggest import SUGGEST_LIMIT
+from .suggest import SUGGEST_MAX_LIMIT
+from .suggest import SUGGEST_MAX_AGE
+from .suggest import suggest_questions
+from .streaming import wants_stream
+from .streaming import stream_questions
+from .quiz import open_quiz_session
+from .quiz import find_quiz_session
+from .quiz import close_quiz_session
+from .quiz import next_session_question
+from .metrics import init_instrumentation
+from .synthetic import init_generate_command
+from .startup import finish_startup
+from .serialization import jsonify
+from .serialization import question_list
+from .serialization import init_compression
 
 
 def create_app(test_config=None):
 
+    started = time.perf_counter()
     app = Flask(__name__)
-    setup_db(app)
-
-    def paginate_questions(request, selection):
-        page = request.args.get('page', 1, type=int)
-
-        start = (page - 1) * QUESTIONS_PER_PAGE
-        end = start + QUESTIONS_PER_PAGE
-
-        questions = [question.format() for question in selection]
-        current_questions = questions[start:end]
-
-        return current_questions
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    setup_db(app, app.config.get('SQLALCHEMY_DATABASE_URI', database_path))
+    init_response_cache(app)
+    init_bulk_commands(app)
+    init_generate_command(app)
+    init_instrumentation(app)
+    init_compression(app)
 
     '''
     @TODO(Done): Set up CORS. Allow '*' for origins.
@@ -53,20 +86,37 @@ def create_app(test_config=None):
     '''
     @app.route('/categories', methods=['GET'])
     def get_categories():
-        categories = Category.query.all()
+        categories = cached_categories()
 
-        if not categories:
+        if not categories['categories']:
             abort(404)
 
-        categories_all = [category.format() for category in categories]
+        if request.args.get('with_counts', 0, type=int) == 1:
+            summary = category_summary(categories['categories'])
+            return jsonify({
+                'success': True,
+                'categories': categories['categories'],
+                'question_counts': {
+                    category_id: category['total_questions']
+                    for category_id, category in summary.items()}
+                })
 
-        ret_categories = {}
-        for cat in categories_all:
-            ret_categories[cat['id']] = cat['type']
+        response = jsonify({
+            'success': True,
+            'categories': categories['categories']
+            })
+        response.set_etag(categories['etag'])
+        response.last_modified = categories['last_modified']
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
 
+    @app.route('/stats', methods=['GET'])
+    def get_stats():
         return jsonify({
             'success': True,
-            'categories': ret_categories
+            'total_questions': count_questions(),
+            'categories': category_summary(
+                cached_categories()['categories'])
             })
 
     '''
@@ -81,23 +131,28 @@ def create_app(test_config=None):
     Clicking on the page numbers should update the questions.
     '''
     @app.route('/questions', methods=['GET'])
+    @cached_response('questions')
     def get_questions():
-        selection = Question.query.order_by(Question.id).all()
-        paginated_questions = paginate_questions(request, selection)
+        if wants_stream(request):
+            categories = cached_categories()['categories']
+            return stream_questions(
+                request, [],
+                success=True,
+                total_questions=count_questions(),
+                categories=categories,
+                current_category=categories)
+
+        paginated_questions, next_after_id = paginate_questions(request)
         if len(paginated_questions) == 0:
             abort(404)
 
-        categories = Category.query.all()
-        categories_all = [category.format() for category in categories]
-
-        ret_categories = {}
-        for cat in categories_all:
-            ret_categories[cat['id']] = cat['type']
+        ret_categories = cached_categories()['categories']
 
         return jsonify({
             'success': True,
-            'questions': paginated_questions,
-            'total_questions': len(selection),
+            'questions': question_list(request, paginated_questions),
+            'total_questions': count_questions(),
+            'next_after_id': next_after_id,
             'categories': ret_categories,
             'current_category': ret_categories
             })
@@ -126,6 +181,37 @@ def create_app(test_config=None):
         except BaseException:
             abort(422)
 
+    @app.route('/questions', methods=['DELETE'])
+    def delete_question_batch():
+        body = request.get_json(silent=True) or {}
+        ids = body.get('ids', None)
+
+        try:
+            if not isinstance(ids, list):
+                raise TypeError
+            ids = [int(question_id) for question_id in ids]
+        except (TypeError, ValueError):
+            abort(400, {'message': 'ids must be a list of question ids'})
+
+        if len(ids) > BATCH_MAX_SIZE:
+            abort(400, {
+                'message':
+                'At most {} questions per batch'.format(BATCH_MAX_SIZE)})
+
+        try:
+            results = delete_questions(ids)
+        except Exception:
+            db.session.rollback()
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'deleted': [result['id'] for result in results
+                        if result['status'] == 'deleted'],
+            'results': results,
+            'total_questions': count_questions()
+            })
+
     @app.route('/questions', methods=['POST'])
     def create_or_search_questions():
 
@@ -138,6 +224,26 @@ def create_app(test_config=None):
 
         search_term = body.get('searchTerm', None)
 
+        if isinstance(body.get('questions', None), list):
+            if len(body['questions']) > BATCH_MAX_SIZE:
+                abort(400, {
+                    'message':
+                    'At most {} questions per batch'.format(BATCH_MAX_SIZE)})
+
+            try:
+                results = create_questions(body['questions'])
+            except Exception:
+                db.session.rollback()
+                abort(422)
+
+            return jsonify({
+                'success': True,
+                'created': [result['id'] for result in results
+                            if result['status'] == 'created'],
+                'results': results,
+                'total_questions': count_questions()
+                })
+
         if search_term is None:
             '''
             @TODO(Done):
@@ -150,40 +256,24 @@ def create_app(test_config=None):
             at the end of the last page of the questions list
             in the "List" tab.
             '''
-            new_question = body.get('question', None)
-            new_answer = body.get('answer', None)
-            new_category = body.get('category', None)
-            new_difficulty = body.get('difficulty', None)
-
-            if not new_question:
-                abort(400, {'message': 'Fill Question Field'})
-
-            if not new_answer:
-                abort(400, {'message': 'Fill Answer Field'})
-
-            if not new_category:
-                abort(400, {'message': 'Fill Category Field'})
-
-            if not new_difficulty:
-                abort(400, {'message': 'Fill Difficulty Field'})
+            try:
+                new_question = validate_question(
+                    body, cached_categories()['categories'])
+            except ValueError as error:
+                abort(400, {'message': str(error)})
 
             try:
-                question = Question(
-                    question=new_question,
-                    answer=new_answer,
-                    category=new_category,
-                    difficulty=new_difficulty
-                    )
-                question.insert()
+                question = Question(**new_question).insert()
 
-                selections = Question.query.order_by(Question.id).all()
-                paginated_questions = paginate_questions(request, selections)
+                paginated_questions, next_after_id = paginate_questions(
+                    request)
 
                 return jsonify({
                     'success': True,
                     'created': question.id,
                     'questions': paginated_questions,
-                    'total_questions': len(selections)
+                    'total_questions': count_questions(),
+                    'next_after_id': next_after_id
                     })
 
             except BaseException:
@@ -198,29 +288,90 @@ def create_app(test_config=None):
             to include only question that include that string within
             their question. Try using the word "title" to start.
             '''
-            questions = Question.query.filter(
-                Question.question.like("%{}%".format(search_term))).all()
+            # like the original LIKE query, any JSON value searches for
+            # its text
+            search_term = str(search_term)
+            questions_found, total_matches = search_questions(
+                search_term, request.args.get('page', 1, type=int))
 
-            if not questions:
+            if not total_matches:
                 abort(
                     404, {
                         'message': 'Question containing "{}": No Found.'
                         .format(search_term)})
 
-            questions_found = [question.format() for question in questions]
-            selections = Question.query.order_by(
-                Question.id).all()
+            if not questions_found:
+                abort(404, {'message': 'No questions in selected page.'})
 
-            categories = Category.query.all()
-            categories_all = [category.format() for category in categories]
+            categories_all = [
+                {'id': category_id, 'type': category_type}
+                for category_id, category_type
+                in cached_categories()['categories'].items()]
 
             return jsonify({
                 'success': True,
-                'questions': questions_found,
-                'total_questions': len(selections),
+                'questions': question_list(request, questions_found),
+                'total_questions': count_questions(),
+                'total_matches': total_matches,
                 'current_category': categories_all
                 })
 
+    '''
+    Question suggestions for a prefix, cached with the question listings
+    so that question writes invalidate them.
+    '''
+    @cached_response('questions')
+    def question_suggestions():
+        limit = min(request.args.get('limit', SUGGEST_LIMIT, type=int),
+                    SUGGEST_MAX_LIMIT)
+        return jsonify({
+            'success': True,
+            'suggestions': suggest_questions(
+                request.args.get('q', ''), max(limit, 1))
+            })
+
+    '''
+    Search-as-you-type: one cacheable GET per prefix, so that browsers
+    and proxies answer repeated keystrokes themselves.
+    '''
+    @app.route('/questions/suggest', methods=['GET'])
+    def get_question_suggestions():
+        response = question_suggestions()
+        response.cache_control.public = True
+        response.cache_control.max_age = SUGGEST_MAX_AGE
+        return response
+
+    '''
+    Bulk import and export, one question per NDJSON line or CSV record.
+    '''
+    @app.route('/questions/import', methods=['POST'])
+    def bulk_import_questions():
+        format = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+        batch_size = min(max(request.args.get(
+            'batch_size', IMPORT_BATCH_SIZE, type=int), 1),
+            IMPORT_MAX_BATCH_SIZE)
+
+        result = import_questions(
+            read_rows(request.stream, format), batch_size)
+
+        return jsonify({
+            'success': True,
+            'imported': result['imported'],
+            'failed': result['failed'],
+            'errors': result['errors']
+            })
+
+    @app.route('/questions/export', methods=['GET'])
+    def bulk_export_questions():
+        format = request.args.get('format', 'ndjson')
+        if format not in ('ndjson', 'csv'):
+            abort(400, {'message': 'format must be ndjson or csv'})
+
+        mimetype = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+        return Response(
+            stream_with_context(export_questions(format)),
+            mimetype=mimetype)
+
     '''
     @TODO(Done): Create a GET endpoint to get questions based on category.
 
@@ -229,27 +380,37 @@ def create_app(test_config=None):
     category to be shown.
     '''
     @app.route('/categories/<string:category_id>/questions', methods=['GET'])
+    @cached_response(category_group)
     def get_questions_from_category(category_id):
-        selection = (Question.query
-                     .filter(Question.category == str(category_id))
-                     .order_by(Question.id)
-                     .all())
+        if not category_id.isdigit():
+            total_questions = 0
+        else:
+            total_questions = count_questions(category_id)
 
-        if not selection:
+        if not total_questions:
             abort(
                 400, {
                     'message': 'No questions with category {} found.'
                     .format(category_id)})
 
-        paginated_questions = paginate_questions(request, selection)
+        if wants_stream(request):
+            return stream_questions(
+                request, [Question.category == int(category_id)],
+                success=True,
+                total_questions=total_questions,
+                current_category=category_id)
+
+        paginated_questions, next_after_id = paginate_questions(
+            request, int(category_id))
 
         if not paginated_questions:
             abort(404, {'message': 'No questions in selected page.'})
 
         return jsonify({
             'success': True,
-            'questions': paginated_questions,
-            'total_questions': len(selection),
+            'questions': question_list(request, paginated_questions),
+            'total_questions': total_questions,
+            'next_after_id': next_after_id,
             'current_category': category_id
             })
 
@@ -274,38 +435,94 @@ def create_app(test_config=None):
                     'message':
                     'No JSON Body'})
 
-        prev_questions = body.get('previous_questions', None)
-        cur_category = body.get('quiz_category', None)
-        if not prev_questions:
-            if cur_category:
-                questions = (
-                    Question.query .filter(
-                        Question.category == str(
-                            cur_category['id'])) .all())
-            else:
-                questions = (Question.query.all())
-        else:
-            if cur_category:
-                questions = (
-                    Question.query .filter(
-                        Question.category == str(
-                            cur_category['id'])) .filter(
-                        Question.id.notin_(prev_questions)) .all())
-            else:
-                questions = (Question.query
-                             .filter(Question.id.notin_(prev_questions))
-                             .all())
-
-        formatted_questions = [question.format() for question in questions]
-        if len(formatted_questions):
-            random_question = formatted_questions[random.randint(
-                0, len(formatted_questions))-1]
-        else:
-            random_question = None
+        prev_questions = body.get('previous_questions', None) or []
+        cur_category = body.get('quiz_category', None) or {}
+
+        try:
+            prev_questions = [int(question_id)
+                              for question_id in prev_questions]
+        except (TypeError, ValueError):
+            abort(
+                400, {
+                    'message':
+                    'previous_questions must be a list of question ids'})
+
+        difficulty = body.get('difficulty', None)
+        if difficulty is not None and not str(difficulty).isdigit():
+            abort(400, {'message': 'Difficulty must be a number'})
+
+        count = body.get('count', 1)
+        if not str(count).isdigit() or not 1 <= int(count) <= QUIZ_MAX_COUNT:
+            abort(400, {
+                'message':
+                'count must be between 1 and {}'.format(QUIZ_MAX_COUNT)})
+
+        questions = random_questions(
+            cur_category.get('id', None), prev_questions, int(count),
+            int(difficulty) if difficulty is not None else None)
+
+        return jsonify({
+            'success': True,
+            'question': questions[0].format() if questions else None,
+            'questions': [question.format() for question in questions]
+            })
+
+    '''
+    Quiz sessions: the server remembers which questions were asked,
+    so clients only send their session token instead of a growing
+    previous_questions list.
+    '''
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def start_quiz_session():
+        body = request.get_json(silent=True) or {}
+        cur_category = body.get('quiz_category', None) or {}
+
+        difficulty = body.get('difficulty', 1)
+        if not str(difficulty).isdigit():
+            abort(400, {'message': 'Difficulty must be a number'})
+
+        token, total_questions = open_quiz_session(
+            cur_category.get('id', None),
+            adaptive=bool(body.get('adaptive', False)),
+            difficulty=int(difficulty))
+
+        return jsonify({
+            'success': True,
+            'quiz_session': token,
+            'total_questions': total_questions
+            })
+
+    @app.route('/quizzes/sessions/<string:token>/next', methods=['POST'])
+    def next_quiz_question(token):
+        session = find_quiz_session(token)
+        if session is None:
+            abort(
+                404, {
+                    'message': 'Quiz session {} not found.'.format(token)})
+
+        body = request.get_json(silent=True) or {}
+        correct = body.get('correct', None)
+        if correct is not None and not isinstance(correct, bool):
+            abort(400, {'message': 'correct must be true or false'})
+
+        question = next_session_question(session, correct)
+
+        return jsonify({
+            'success': True,
+            'question': question.format() if question else None,
+            'remaining': session.remaining()
+            })
+
+    @app.route('/quizzes/sessions/<string:token>', methods=['DELETE'])
+    def end_quiz_session(token):
+        if not close_quiz_session(token):
+            abort(
+                404, {
+                    'message': 'Quiz session {} not found.'.format(token)})
 
         return jsonify({
             'success': True,
-            'question': random_question
+            'deleted': token
             })
 
     '''
@@ -358,4 +575,5 @@ def create_app(test_config=None):
             "message": get_error_message(error, "Internal Server Error")
             }), 500
 
+    finish_startup(app, started)
     return app
@@ -0,0 +1,195 @@
+import asyncio
+import sys
+import tempfile
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from . import create_app
+
+ASGI_THREADS = 32
+ASGI_QUEUE_SIZE = 16
+ASGI_SPOOL_SIZE = 1024 * 1024
+
+'''
+ASGI serving mode
+
+    uvicorn --factory flaskr.asgi:create_asgi_app
+
+serves the routes of create_app() on an asyncio server. SQLAlchemy 1.3
+and psycopg2 have no asyncio interface, so requests are handled by the
+same Flask app, each on one of ASGI_THREADS threads, while the event
+loop only moves bytes: slow clients and idle keep-alive connections no
+longer occupy a worker, and validation and serialization are the same
+as in the WSGI app. Like a WSGI server, the bridge answers errors raised
+before the response started with a 500, and stops iterating a response
+once its client went away.
+'''
+
+
+def build_environ(scope, body, content_length):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+
+    def wsgi_string(value):
+        return value.encode('utf-8').decode('latin-1')
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': wsgi_string(scope.get('root_path', '')),
+        'PATH_INFO': wsgi_string(scope['path']),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(content_length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        }
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        if name != 'CONTENT_TYPE':
+            name = 'HTTP_' + name
+        if name in environ:
+            value = environ[name] + ',' + value
+        environ[name] = value
+
+    return environ
+
+
+class AsgiApp:
+
+    def __init__(self, wsgi_app, threads=ASGI_THREADS):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, receive):
+        body = tempfile.SpooledTemporaryFile(ASGI_SPOOL_SIZE)
+        length = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None, 0
+            chunk = message.get('body', b'')
+            body.write(chunk)
+            length += len(chunk)
+            more_body = message.get('more_body', False)
+        body.seek(0)
+        return body, length
+
+    async def http(self, scope, receive, send):
+        body, length = await self.read_body(receive)
+        if body is None:
+            # the client went away before sending the whole request
+            return
+        environ = build_environ(scope, body, length)
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(ASGI_QUEUE_SIZE)
+        cancelled = threading.Event()
+        response = {}
+
+        def put(item):
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers]
+
+        # the response is produced and iterated on a single thread, as
+        # streamed responses hold their app context in thread locals
+        def run():
+            try:
+                result = self.wsgi_app(environ, start_response)
+                try:
+                    for chunk in result:
+                        if cancelled.is_set():
+                            break
+                        if chunk:
+                            put(chunk)
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+            except Exception as error:
+                put(error)
+            finally:
+                body.close()
+                put(None)
+
+        future = loop.run_in_executor(self.executor, run)
+        started = False
+        try:
+            while True:
+                item = await queue.get()
+                if isinstance(item, Exception):
+                    if started:
+                        raise item
+                    # nothing was sent yet: answer like a WSGI server
+                    traceback.print_exception(
+                        type(item), item, item.__traceback__,
+                        file=environ['wsgi.errors'])
+                    await send({
+                        'type': 'http.response.start',
+                        'status': 500,
+                        'headers': [(b'content-type', b'text/plain')]})
+                    await send({
+                        'type': 'http.response.body',
+                        'body': b'Internal Server Error'})
+                    break
+                if not started:
+                    await send({
+                        'type': 'http.response.start',
+                        'status': response['status'],
+                        'headers': response['headers']})
+                    started = True
+                if item is None:
+                    await send({'type': 'http.response.body', 'body': b''})
+                    break
+                await send({
+                    'type': 'http.response.body',
+                    'body': item,
+                    'more_body': True})
+        finally:
+            # if the client went away, drain the queue until the
+            # producer notices and stops
+            cancelled.set()
+            while not future.done():
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait(
+                    {getter, future}, return_when=asyncio.FIRST_COMPLETED)
+                getter.cancel()
+
+
+def create_asgi_app(test_config=None, threads=ASGI_THREADS):
+    app = create_app(test_config)
+    return AsgiApp(app.wsgi_app, app.config.get('ASGI_THREADS', threads))
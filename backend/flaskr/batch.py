@@ -0,0 +1,123 @@
+from flask import current_app
+from sqlalchemy import Integer
+from sqlalchemy import any_
+from sqlalchemy import bindparam
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from models import db
+from models import Question
+from models import QuestionRow
+from models import cached_categories
+from models import notify_question_write
+
+from .validation import validate_question
+
+BATCH_MAX_SIZE = 1000
+
+'''
+Batched writes
+
+create_questions and delete_questions apply a whole list of questions in
+one transaction with a single commit: deletes run as one
+DELETE ... WHERE id = ANY(...) (IN (...) outside Postgres), and inserts
+as one multi-row INSERT ... RETURNING id on Postgres. With
+BATCH_ASYNC_COMMIT = True in the app config, Postgres acknowledges these
+commits before they are flushed to disk (synchronous_commit = off): a
+crash can lose the last batches, but never leaves a half-applied one.
+'''
+
+
+def begin_batch():
+    if (db.engine.dialect.name == 'postgresql' and
+            current_app.config.get('BATCH_ASYNC_COMMIT', False)):
+        db.session.execute('SET LOCAL synchronous_commit TO OFF')
+
+
+def matching_ids(ids):
+    if db.engine.dialect.name == 'postgresql':
+        return Question.id == any_(
+            bindparam('ids', ids, type_=ARRAY(Integer)))
+    return Question.id.in_(ids)
+
+
+'''
+delete_questions(ids)
+    deletes the questions with the given ids and returns the outcome of
+    every id, in order: 'deleted' or 'not_found'.
+'''
+
+
+def delete_questions(ids):
+    ids = list(dict.fromkeys(ids))
+    table = Question.__table__
+    columns = (table.c.id, table.c.question, table.c.answer,
+               table.c.category, table.c.difficulty)
+
+    begin_batch()
+    if db.engine.dialect.name == 'postgresql':
+        rows = db.session.execute(
+            table.delete().where(matching_ids(ids)).returning(*columns))
+        deleted = [QuestionRow(*row) for row in rows]
+    else:
+        deleted = [QuestionRow(*row)
+                   for row in QuestionRow.query(matching_ids(ids))]
+        db.session.execute(table.delete().where(matching_ids(ids)))
+    db.session.commit()
+
+    if deleted:
+        notify_question_write('delete', deleted)
+
+    deleted_ids = {question.id for question in deleted}
+    return [{'id': question_id,
+             'status': 'deleted' if question_id in deleted_ids
+             else 'not_found'}
+            for question_id in ids]
+
+
+'''
+create_questions(bodies)
+    inserts the valid questions of `bodies` (objects with the fields of
+    POST /questions) and returns the outcome of every body, in order:
+    'created' with the new id, or 'invalid' with a message.
+'''
+
+
+def create_questions(bodies):
+    categories = cached_categories()['categories']
+    results = []
+    rows = []
+
+    for index, body in enumerate(bodies):
+        try:
+            if not isinstance(body, dict):
+                raise ValueError('Question must be an object')
+            values = validate_question(body, categories)
+        except ValueError as error:
+            results.append(
+                {'index': index, 'status': 'invalid', 'message': str(error)})
+            continue
+        results.append({'index': index, 'status': 'created'})
+        rows.append(values)
+
+    if not rows:
+        return results
+
+    table = Question.__table__
+    begin_batch()
+    if db.engine.dialect.name == 'postgresql':
+        ids = [question_id for question_id, in db.session.execute(
+            table.insert().values(rows).returning(table.c.id))]
+    else:
+        ids = [db.session.execute(table.insert(), row).inserted_primary_key[0]
+               for row in rows]
+    db.session.commit()
+
+    created = [QuestionRow(question_id, **row)
+               for question_id, row in zip(ids, rows)]
+    notify_question_write('insert', created)
+
+    ids = iter(ids)
+    for result in results:
+        if result['status'] == 'created':
+            result['id'] = next(ids)
+    return results
@@ -0,0 +1,196 @@
+import csv
+import io
+import json
+from types import SimpleNamespace
+import click
+from flask import current_app
+
+from models import db
+from models import create_schema
+from models import Question
+from models import cached_categories
+from models import notify_question_write
+
+from .validation import validate_question
+from .streaming import STREAM_BATCH_SIZE
+from .streaming import QUESTION_FIELDS
+from .streaming import question_rows
+from .streaming import ndjson_chunks
+
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_BATCH_SIZE = 10000
+IMPORT_MAX_ERRORS = 100
+
+IMPORT_COLUMNS = ('question', 'answer', 'category', 'difficulty')
+
+'''
+Bulk import and export of questions
+
+Both directions stream: imports read one line at a time and write in
+batches of IMPORT_BATCH_SIZE rows (at most IMPORT_MAX_BATCH_SIZE), each
+in its own transaction (COPY on Postgres, executemany elsewhere);
+exports read through a server side cursor and write chunks of
+STREAM_BATCH_SIZE rows. Rows are NDJSON
+objects or CSV records with the fields of POST /questions.
+'''
+
+
+def read_rows(lines, format='ndjson'):
+    lines = (line.decode('utf-8', 'replace') if isinstance(line, bytes)
+             else line for line in lines)
+
+    if format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row
+
+
+def insert_batch(rows):
+    if db.engine.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(
+            [row[column] for column in IMPORT_COLUMNS] for row in rows)
+        buffer.seek(0)
+
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert(
+            'COPY questions ({}) FROM STDIN WITH CSV'
+            .format(', '.join(IMPORT_COLUMNS)), buffer)
+    else:
+        db.session.execute(Question.__table__.insert(), rows)
+
+
+class QuestionImport:
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE):
+        self.batch_size = max(batch_size, 1)
+        self.categories = cached_categories()['categories']
+        self.batch = []
+        self.lines = []
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line_number, message):
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({'line': line_number, 'message': message})
+
+    def add(self, line_number, row):
+        try:
+            if not isinstance(row, dict):
+                raise ValueError('Row is not a question object')
+            values = validate_question(row, self.categories)
+        except ValueError as error:
+            self.error(line_number, str(error))
+            return
+
+        self.batch.append(values)
+        self.lines.append(line_number)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+
+        try:
+            insert_batch(self.batch)
+            db.session.commit()
+        except Exception as error:
+            db.session.rollback()
+            for line_number in self.lines:
+                self.error(line_number, 'Batch failed: {}'.format(error))
+        else:
+            self.imported += len(self.batch)
+            notify_question_write('bulk', [
+                SimpleNamespace(id=None, category=category)
+                for category in {row['category'] for row in self.batch}])
+
+        self.batch = []
+        self.lines = []
+
+    def result(self):
+        return {
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': self.errors
+            }
+
+
+'''
+import_questions(rows, batch_size=IMPORT_BATCH_SIZE)
+    inserts the (line_number, row) pairs of `rows` as read by read_rows
+    and returns the number of imported and failed rows, and the errors
+    of the first IMPORT_MAX_ERRORS failed rows by line.
+'''
+
+
+def import_questions(rows, batch_size=IMPORT_BATCH_SIZE):
+    question_import = QuestionImport(batch_size)
+    for line_number, row in rows:
+        question_import.add(line_number, row)
+    question_import.flush()
+    return question_import.result()
+
+
+'''
+export_questions(format='ndjson')
+    yields all questions ordered by id as chunks of NDJSON or CSV text.
+'''
+
+
+def export_questions(format='ndjson'):
+    rows = question_rows()
+    if format != 'csv':
+        yield from ndjson_chunks(rows)
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(QUESTION_FIELDS)
+
+    for number, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if number % STREAM_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def guess_format(name):
+    return 'csv' if str(name).endswith('.csv') else 'ndjson'
+
+
+def init_bulk_commands(app):
+
+    @app.cli.command('import-questions')
+    @click.argument('source', type=click.File('r', encoding='utf-8'))
+    @click.option('--format', type=click.Choice(['ndjson', 'csv']))
+    @click.option('--batch-size', default=IMPORT_BATCH_SIZE)
+    def import_questions_command(source, format, batch_size):
+        '''Import questions from an NDJSON or CSV file.'''
+        create_schema(current_app)
+        rows = read_rows(source, format or guess_format(source.name))
+        result = import_questions(rows, batch_size)
+        click.echo(json.dumps(result, indent=2))
+
+    @app.cli.command('export-questions')
+    @click.argument('target', type=click.File('w', encoding='utf-8'))
+    @click.option('--format', type=click.Choice(['ndjson', 'csv']))
+    def export_questions_command(target, format):
+        '''Export all questions to an NDJSON or CSV file.'''
+        for chunk in export_questions(format or guess_format(target.name)):
+            target.write(chunk)
@@ -0,0 +1,178 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app
+from flask import request
+
+from models import on_category_write
+from models import on_question_write
+
+from .streaming import wants_stream
+
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_SECONDS = 30
+
+'''
+CacheBackend
+    interface of response cache backends. LRUCache is the in-process
+    default; a shared backend (memcached, redis, ...) implements the same
+    two methods and is passed as RESPONSE_CACHE_BACKEND in the app config.
+    Keys are strings, values are (body, mimetype) tuples.
+'''
+
+
+class CacheBackend:
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE,
+                 ttl=RESPONSE_CACHE_SECONDS):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+'''
+ResponseCache
+    caches response bodies by group (e.g. 'questions' or 'category:3') and
+    request path. Each group has a version stored in the backend itself,
+    so invalidating a group is a single write that orphans all of its
+    pages, and works the same for every worker sharing a backend.
+'''
+
+
+class ResponseCache:
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def version(self, group):
+        version = self.backend.get('version:' + group)
+        if version is None:
+            # never restart at a number, an evicted version could
+            # otherwise resurrect stale pages
+            version = uuid.uuid4().hex
+            self.backend.set('version:' + group, version, ttl=0)
+        return version
+
+    def key(self, group, path):
+        return 'response:{}:{}:{}'.format(group, self.version(group), path)
+
+    def invalidate(self, group):
+        self.backend.set('version:' + group, uuid.uuid4().hex, ttl=0)
+
+
+def init_response_cache(app):
+    backend = app.config.get('RESPONSE_CACHE_BACKEND', None)
+    size = app.config.get('RESPONSE_CACHE_SIZE', RESPONSE_CACHE_SIZE)
+    if backend is None and size:
+        backend = LRUCache(
+            size,
+            app.config.get('RESPONSE_CACHE_SECONDS', RESPONSE_CACHE_SECONDS))
+
+    app.extensions['response_cache'] = (
+        ResponseCache(backend) if backend is not None else None)
+
+
+'''
+cached_response(group)
+    decorates a GET view so that its successful responses are cached
+    under `group`, a string or a function of the view arguments.
+    Streamed responses are never cached.
+'''
+
+
+def cached_response(group):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            cache = current_app.extensions.get('response_cache')
+            if cache is None or wants_stream(request):
+                return view(**kwargs)
+
+            group_name = group(**kwargs) if callable(group) else group
+            key = cache.key(group_name, request.full_path)
+            hit = cache.backend.get(key)
+            if hit is not None:
+                return current_app.response_class(hit[0], mimetype=hit[1])
+
+            response = current_app.make_response(view(**kwargs))
+            if response.status_code == 200:
+                cache.backend.set(
+                    key, (response.get_data(), response.mimetype))
+            return response
+        return wrapper
+    return decorator
+
+
+def category_group(category_id):
+    if str(category_id).isdigit():
+        category_id = int(category_id)
+    return 'category:{}'.format(category_id)
+
+
+'''
+Every cached page carries total_questions, so a write invalidates all
+pages of /questions and of the written question's category, while the
+pages of other categories stay cached.
+'''
+
+
+@on_question_write
+def invalidate_responses(action, questions):
+    cache = current_app.extensions.get('response_cache')
+    if cache is None:
+        return
+
+    groups = {'questions'}
+    groups.update(category_group(question.category) for question in questions)
+    for group in groups:
+        cache.invalidate(group)
+
+
+'''
+Pages of /questions carry the categories, and deleting a category moves
+its questions out of it, so category writes invalidate the pages of
+/questions and of the written categories.
+'''
+
+
+@on_category_write
+def invalidate_category_responses(action, category_ids):
+    cache = current_app.extensions.get('response_cache')
+    if cache is None:
+        return
+
+    cache.invalidate('questions')
+    for category_id in category_ids:
+        cache.invalidate(category_group(category_id))
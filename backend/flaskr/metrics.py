@@ -0,0 +1,278 @@
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from flask import Response
+from flask import g
+from flask import has_request_context
+from flask import request
+from sqlalchemy import event
+
+from config import instrumentation
+from config import profile_sample_rate
+from config import profile_slow_ms
+from config import profile_dir
+from models import db
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+'''
+Request instrumentation
+
+Enabled with INSTRUMENTATION = True in the app config (defaults for the
+settings below come from config.py). Every request then
+records its wall time, the number and duration of its SQL statements, the
+rows they returned (as reported by the driver), the time spent encoding
+JSON and the size of the response. The figures of a request are sent
+back in a Server-Timing header, and GET /metrics exposes the totals per
+endpoint in the Prometheus text format, together with the pool counters
+of models.watch_pool. Metrics are kept per worker process.
+
+With PROFILE_SAMPLE_RATE > 0 that share of requests is profiled, and
+profiles of requests slower than PROFILE_SLOW_MS are written to
+PROFILE_DIR: pyinstrument HTML when pyinstrument is installed and
+PROFILER = 'pyinstrument', cProfile stats otherwise.
+'''
+
+
+def record_timing(name, seconds):
+    if has_request_context():
+        timing = g.get('request_timing')
+        if timing is not None:
+            timing[name] = timing.get(name, 0) + seconds
+
+
+def watch_queries(engine):
+    if getattr(engine, 'watching_queries', False):
+        return
+    engine.watching_queries = True
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(connection, cursor, statement, parameters,
+                              context, executemany):
+        context.query_started = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(connection, cursor, statement, parameters,
+                             context, executemany):
+        if not has_request_context():
+            return
+        timing = g.get('request_timing')
+        if timing is None:
+            return
+        timing['queries'] += 1
+        timing['db_seconds'] += time.perf_counter() - context.query_started
+        if statement.lstrip()[:6].upper() == 'SELECT' and cursor.rowcount > 0:
+            timing['rows'] += cursor.rowcount
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.endpoints = {}
+
+    def record(self, endpoint, method, status, timing, response_bytes):
+        with self.lock:
+            key = (endpoint, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = {
+                    'buckets': [0] * len(DURATION_BUCKETS),
+                    'count': 0,
+                    'seconds': 0.0,
+                    'queries': 0,
+                    'db_seconds': 0.0,
+                    'rows': 0,
+                    'serialize_seconds': 0.0,
+                    'response_bytes': 0
+                    }
+
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if timing['seconds'] <= bound:
+                    stats['buckets'][index] += 1
+            stats['count'] += 1
+            stats['seconds'] += timing['seconds']
+            stats['queries'] += timing['queries']
+            stats['db_seconds'] += timing['db_seconds']
+            stats['rows'] += timing['rows']
+            stats['serialize_seconds'] += timing.get('serialize_seconds', 0)
+            stats['response_bytes'] += response_bytes
+
+    def render(self, pool_metrics=None, startup_timings=None):
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for labels, value in samples:
+                lines.append('{}{{{}}} {}'.format(
+                    name,
+                    ','.join('{}="{}"'.format(label, label_value)
+                             for label, label_value in labels),
+                    value))
+
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+
+            metric('trivia_requests_total', 'counter', 'Requests handled.', [
+                ((('endpoint', endpoint), ('method', method),
+                  ('status', status)), count)
+                for (endpoint, method, status), count
+                in sorted(self.requests.items())])
+
+            lines.append('# HELP trivia_request_duration_seconds '
+                         'Wall time of requests.')
+            lines.append('# TYPE trivia_request_duration_seconds histogram')
+            for endpoint, stats in endpoints:
+                for bound, count in zip(DURATION_BUCKETS, stats['buckets']):
+                    lines.append(
+                        'trivia_request_duration_seconds_bucket'
+                        '{{endpoint="{}",le="{}"}} {}'.format(
+                            endpoint, bound, count))
+                lines.append(
+                    'trivia_request_duration_seconds_bucket'
+                    '{{endpoint="{}",le="+Inf"}} {}'.format(
+                        endpoint, stats['count']))
+                lines.append(
+                    'trivia_request_duration_seconds_sum'
+                    '{{endpoint="{}"}} {}'.format(endpoint, stats['seconds']))
+                lines.append(
+                    'trivia_request_duration_seconds_count'
+                    '{{endpoint="{}"}} {}'.format(endpoint, stats['count']))
+
+            for name, key, help in (
+                    ('trivia_db_queries_total', 'queries',
+                     'SQL statements executed.'),
+                    ('trivia_db_duration_seconds_total', 'db_seconds',
+                     'Time spent executing SQL statements.'),
+                    ('trivia_db_rows_total', 'rows',
+                     'Rows returned by SQL statements.'),
+                    ('trivia_serialize_duration_seconds_total',
+                     'serialize_seconds', 'Time spent encoding JSON.'),
+                    ('trivia_response_bytes_total', 'response_bytes',
+                     'Bytes of response bodies.')):
+                metric(name, 'counter', help, [
+                    ((('endpoint', endpoint),), stats[key])
+                    for endpoint, stats in endpoints])
+
+        for key, value in sorted((pool_metrics or {}).items()):
+            kind = 'gauge' if key == 'checked_out' else 'counter'
+            suffix = '' if kind == 'gauge' else '_total'
+            name = 'trivia_db_pool_{}{}'.format(key, suffix)
+            lines.append('# TYPE {} {}'.format(name, kind))
+            lines.append('{} {}'.format(name, value))
+
+        if startup_timings:
+            metric('trivia_startup_seconds', 'gauge',
+                   'Time spent in each startup phase.', [
+                       ((('phase', phase),), seconds)
+                       for phase, seconds in sorted(startup_timings.items())])
+
+        return '\n'.join(lines) + '\n'
+
+
+def start_profiler(app):
+    if app.config.get('PROFILER') == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            pass
+        else:
+            profiler = Profiler()
+            profiler.start()
+            return profiler
+
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def dump_profile(app, profiler, endpoint, seconds):
+    directory = (app.config.get('PROFILE_DIR', profile_dir) or
+                 os.path.join(tempfile.gettempdir(), 'trivia-profiles'))
+    os.makedirs(directory, exist_ok=True)
+    name = '{}-{}-{:.0f}ms'.format(
+        time.strftime('%Y%m%d-%H%M%S'),
+        re.sub(r'[^A-Za-z0-9]+', '_', endpoint).strip('_') or 'root',
+        seconds * 1000)
+
+    if hasattr(profiler, 'output_html'):
+        with open(os.path.join(directory, name + '.html'), 'w') as output:
+            output.write(profiler.output_html())
+    else:
+        profiler.dump_stats(os.path.join(directory, name + '.prof'))
+
+
+def stop_profiler(profiler):
+    if hasattr(profiler, 'output_html'):
+        profiler.stop()
+    else:
+        profiler.disable()
+
+
+def server_timing(timing):
+    return ', '.join([
+        'app;dur={:.2f}'.format(timing['seconds'] * 1000),
+        'db;dur={:.2f};desc="{} queries, {} rows"'.format(
+            timing['db_seconds'] * 1000, timing['queries'], timing['rows']),
+        'serialize;dur={:.2f}'.format(
+            timing.get('serialize_seconds', 0) * 1000)])
+
+
+def init_instrumentation(app):
+    if not app.config.get('INSTRUMENTATION', instrumentation):
+        return
+
+    watch_queries(db.get_engine(app))
+    metrics = app.extensions['request_metrics'] = RequestMetrics()
+    sample_rate = app.config.get('PROFILE_SAMPLE_RATE', profile_sample_rate)
+    slow_seconds = app.config.get('PROFILE_SLOW_MS', profile_slow_ms) / 1000
+
+    @app.before_request
+    def start_request_timing():
+        g.request_timing = {
+            'started': time.perf_counter(),
+            'queries': 0,
+            'db_seconds': 0.0,
+            'rows': 0
+            }
+        if sample_rate and random.random() < sample_rate:
+            g.profiler = start_profiler(app)
+
+    @app.after_request
+    def record_request_timing(response):
+        timing = g.get('request_timing')
+        if timing is None:
+            return response
+        timing['seconds'] = time.perf_counter() - timing['started']
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            stop_profiler(profiler)
+            if timing['seconds'] >= slow_seconds:
+                dump_profile(app, profiler, endpoint, timing['seconds'])
+
+        response_bytes = 0
+        if not response.is_streamed:
+            response_bytes = response.calculate_content_length() or 0
+
+        metrics.record(
+            endpoint, request.method, response.status_code, timing,
+            response_bytes)
+        response.headers['Server-Timing'] = server_timing(timing)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return Response(
+            metrics.render(app.extensions.get('pool_metrics'),
+                           app.extensions.get('startup_timings')),
+            mimetype='text/plain; version=0.0.4')
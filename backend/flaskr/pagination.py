@@ -0,0 +1,87 @@
+from bisect import bisect_right
+
+from models import Question
+from models import QuestionRow
+
+from .stats import get_category_stats
+from .store import current_snapshot
+
+QUESTIONS_PER_PAGE = 10
+
+'''
+paginate_questions(request, category=None)
+    returns one page of the questions, optionally within one category, as
+    formatted questions, together with
+    the id to send as `after_id` for the next page (None on the last page).
+    The page is cut in SQL: `?page=` uses LIMIT/OFFSET, `?after_id=` uses
+    a keyset on the primary key, which stays fast however deep it goes.
+    With the shared question store enabled, the page is cut from its
+    snapshot instead, by position or by bisecting the ids.
+'''
+
+
+def paginate_questions(request, category=None):
+    snapshot = current_snapshot()
+    if snapshot is not None:
+        return paginate_snapshot(request, snapshot, category)
+
+    after_id = request.args.get('after_id', None, type=int)
+
+    query = QuestionRow.query().order_by(Question.id)
+    if category is not None:
+        query = query.filter(Question.category == category)
+    if after_id is not None:
+        query = query.filter(Question.id > after_id)
+    else:
+        page = request.args.get('page', 1, type=int)
+        if page < 1:
+            return [], None
+        query = query.offset((page - 1) * QUESTIONS_PER_PAGE)
+
+    # one extra row tells us whether there is a next page
+    selection = query.limit(QUESTIONS_PER_PAGE + 1).all()
+    current_questions = selection[:QUESTIONS_PER_PAGE]
+
+    next_after_id = None
+    if len(selection) > QUESTIONS_PER_PAGE:
+        next_after_id = current_questions[-1].id
+
+    return [QuestionRow(*row).format() for row in current_questions], \
+        next_after_id
+
+
+def paginate_snapshot(request, snapshot, category=None):
+    ids = snapshot.ids_of(category)
+    after_id = request.args.get('after_id', None, type=int)
+
+    if after_id is not None:
+        start = bisect_right(ids, after_id)
+    else:
+        page = request.args.get('page', 1, type=int)
+        if page < 1:
+            return [], None
+        start = (page - 1) * QUESTIONS_PER_PAGE
+
+    selection = ids[start:start + QUESTIONS_PER_PAGE + 1]
+    current_ids = selection[:QUESTIONS_PER_PAGE]
+
+    next_after_id = None
+    if len(selection) > QUESTIONS_PER_PAGE:
+        next_after_id = current_ids[-1]
+
+    rows = snapshot.rows(current_ids)
+    return [rows[question_id].format() for question_id in current_ids], \
+        next_after_id
+
+
+'''
+count_questions(category=None)
+    returns the number of questions, optionally within one category, from
+    the per-category statistics of flaskr/stats.py.
+'''
+
+
+def count_questions(category=None):
+    if category is not None:
+        category = int(category)
+    return get_category_stats().total(category)
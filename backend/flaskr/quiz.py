@@ -0,0 +1,438 @@
+import random
+import secrets
+import threading
+import time
+from array import array
+from flask import current_app
+
+from models import db
+from models import Question
+from models import QuestionRow
+from models import on_question_write
+
+from .store import current_snapshot
+
+SAMPLER_REFRESH_SECONDS = 60
+SAMPLER_ATTEMPTS = 16
+QUIZ_MAX_COUNT = 50
+
+'''
+category_key(category)
+    normalizes a category id as sent by clients. The frontend sends
+    id 0 for "ALL", which maps to None like a missing category.
+'''
+
+
+def category_key(category):
+    if category is None or str(category) in ('', '0'):
+        return None
+    return str(category)
+
+
+'''
+QuestionSampler
+    keeps the ids of every category, and of every (category, difficulty)
+    bucket, in flat arrays so that a random unseen question is drawn in
+    O(1) expected time, without loading candidates. It is loaded from the
+    shared question store when enabled. Inserts and deletes of
+    this worker patch the arrays in place; they are rebuilt every
+    SAMPLER_REFRESH_SECONDS to pick up writes of other workers.
+'''
+
+
+class QuestionSampler:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = {}
+        self.buckets = {}
+        self.deleted = set()
+        self.loaded_at = None
+
+    def load(self):
+        ids = {None: array('l')}
+        buckets = {}
+        snapshot = current_snapshot()
+        if snapshot is not None:
+            rows = snapshot.columns()
+        else:
+            rows = db.session.query(
+                Question.id, Question.category, Question.difficulty)
+        for question_id, category, difficulty in rows:
+            self.index(ids, buckets, question_id, category, difficulty)
+
+        self.ids = ids
+        self.buckets = buckets
+        self.deleted = set()
+        self.loaded_at = time.monotonic()
+
+    @staticmethod
+    def index(ids, buckets, question_id, category, difficulty):
+        # questions without a difficulty are only drawn when no
+        # difficulty is asked for, so they get no difficulty bucket
+        key = category_key(category)
+        ids[None].append(question_id)
+        if key is not None:
+            ids.setdefault(key, array('l')).append(question_id)
+        if difficulty is None:
+            return
+        buckets.setdefault((None, difficulty), array('l')).append(question_id)
+        if key is not None:
+            buckets.setdefault((key, difficulty), array('l')) \
+                .append(question_id)
+
+    def expired(self):
+        return (self.loaded_at is None or
+                time.monotonic() - self.loaded_at >= SAMPLER_REFRESH_SECONDS)
+
+    def ensure_loaded(self):
+        if not self.expired():
+            return
+        with self.lock:
+            if self.expired():
+                self.load()
+
+    def add(self, question):
+        if self.loaded_at is None:
+            return
+        self.index(self.ids, self.buckets, question.id, question.category,
+                   question.difficulty)
+
+    def discard(self, question_id):
+        self.deleted.add(question_id)
+
+    def draw(self, category=None, excluded=frozenset(), difficulty=None):
+        self.ensure_loaded()
+        if difficulty is None:
+            pool = self.ids.get(category_key(category), ())
+        else:
+            pool = self.buckets.get((category_key(category), difficulty), ())
+        deleted = self.deleted
+
+        # rejection sampling is uniform and needs n / (n - k) tries on
+        # average; nearly exhausted pools fall back to a single scan
+        for _ in range(SAMPLER_ATTEMPTS):
+            if not pool:
+                return None
+            question_id = pool[random.randrange(len(pool))]
+            if question_id not in excluded and question_id not in deleted:
+                return question_id
+
+        candidates = [
+            question_id for question_id in pool
+            if question_id not in excluded and question_id not in deleted]
+        if not candidates:
+            return None
+        return random.choice(candidates)
+
+    def draw_near(self, category, excluded, difficulty):
+        self.ensure_loaded()
+        key = category_key(category)
+        difficulties = sorted(
+            (bucket_difficulty for bucket_category, bucket_difficulty
+             in list(self.buckets) if bucket_category == key),
+            key=lambda bucket_difficulty: (
+                abs(bucket_difficulty - difficulty), bucket_difficulty))
+
+        for bucket_difficulty in difficulties:
+            question_id = self.draw(category, excluded, bucket_difficulty)
+            if question_id is not None:
+                return question_id
+        return None
+
+
+def get_sampler():
+    sampler = current_app.extensions.get('question_sampler')
+    if sampler is None:
+        sampler = QuestionSampler()
+        current_app.extensions['question_sampler'] = sampler
+    return sampler
+
+
+'''
+random_questions(category=None, previous_questions=(), count=1,
+                 difficulty=None)
+    returns up to `count` distinct random QuestionRows of `category` (all
+    categories if None) which are not in `previous_questions`; fewer when
+    not enough are left. The ids are drawn from the sampler and the rows
+    read with a single query, or from the shared question store. With a
+    `difficulty`, the questions are of that difficulty, or of the nearest
+    one which still has questions left.
+'''
+
+
+def random_questions(category=None, previous_questions=(), count=1,
+                     difficulty=None):
+    sampler = get_sampler()
+    excluded = previous_questions
+    if count > 1 or not isinstance(excluded, (set, frozenset)):
+        excluded = set(excluded)
+
+    questions = []
+    while len(questions) < count:
+        drawn = []
+        for _ in range(count - len(questions)):
+            if difficulty is None:
+                question_id = sampler.draw(category, excluded)
+            else:
+                question_id = sampler.draw_near(
+                    category, excluded, difficulty)
+            if question_id is None:
+                break
+            drawn.append(question_id)
+            if count > 1:
+                excluded.add(question_id)
+        if not drawn:
+            break
+
+        snapshot = current_snapshot()
+        if snapshot is not None:
+            rows = snapshot.rows(drawn)
+        else:
+            rows = {row.id: QuestionRow(*row)
+                    for row in QuestionRow.query(Question.id.in_(drawn))}
+        for question_id in drawn:
+            if question_id in rows:
+                questions.append(rows[question_id])
+            else:
+                # deleted by another worker since the last refresh
+                sampler.discard(question_id)
+
+    return questions
+
+
+def random_question(category=None, previous_questions=(), difficulty=None):
+    questions = random_questions(
+        category, previous_questions, 1, difficulty)
+    return questions[0] if questions else None
+
+
+@on_question_write
+def update_sampler(action, questions):
+    sampler = current_app.extensions.get('question_sampler')
+    if sampler is None:
+        return
+
+    if action == 'bulk':
+        sampler.loaded_at = None
+        return
+
+    for question in questions:
+        if action == 'insert':
+            sampler.add(question)
+        else:
+            sampler.discard(question.id)
+
+
+QUIZ_SESSION_SECONDS = 30 * 60
+
+# adaptive quizzes: the target difficulty rises by QUIZ_RAMP_STEP with
+# every question, and moves by QUIZ_CORRECT_STEP or QUIZ_WRONG_STEP when
+# the client reports the answer to the previous question
+QUIZ_MIN_DIFFICULTY = 1
+QUIZ_MAX_DIFFICULTY = 5
+QUIZ_RAMP_STEP = 0.25
+QUIZ_CORRECT_STEP = 0.5
+QUIZ_WRONG_STEP = -1.0
+
+'''
+QuizSession
+    a server side quiz over a fixed snapshot of question ids. Questions are
+    handed out in a random permutation built lazily (Fisher-Yates over a
+    sparse swap table), so each draw is O(1) and the session only stores
+    the positions it has touched instead of a copy of the id array.
+'''
+
+
+class QuizSession:
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.size = len(pool)
+        self.position = 0
+        self.swaps = {}
+        self.touch()
+
+    def touch(self):
+        self.expires_at = time.monotonic() + QUIZ_SESSION_SECONDS
+
+    def remaining(self):
+        return self.size - self.position
+
+    def next_id(self):
+        if self.position >= self.size:
+            return None
+
+        i = self.position
+        j = random.randrange(i, self.size)
+        head = self.swaps.pop(i, self.pool[i])
+        if j == i:
+            picked = head
+        else:
+            picked = self.swaps.get(j, self.pool[j])
+            self.swaps[j] = head
+
+        self.position += 1
+        return picked
+
+
+'''
+AdaptiveQuizSession
+    a server side quiz which follows a difficulty curve instead of a
+    permutation: every question is drawn from the (category, difficulty)
+    bucket of the sampler nearest to the current level, which ramps up
+    and adapts to the answers the client reports.
+'''
+
+
+class AdaptiveQuizSession:
+
+    def __init__(self, category, size, difficulty=QUIZ_MIN_DIFFICULTY):
+        self.category = category
+        self.size = size
+        self.level = float(difficulty)
+        self.asked = set()
+        self.touch()
+
+    def touch(self):
+        self.expires_at = time.monotonic() + QUIZ_SESSION_SECONDS
+
+    def remaining(self):
+        return max(self.size - len(self.asked), 0)
+
+    def next_difficulty(self, correct=None):
+        if self.asked:
+            self.level += QUIZ_RAMP_STEP
+            if correct is True:
+                self.level += QUIZ_CORRECT_STEP
+            elif correct is False:
+                self.level += QUIZ_WRONG_STEP
+            self.level = min(max(self.level, QUIZ_MIN_DIFFICULTY),
+                             QUIZ_MAX_DIFFICULTY)
+        return int(self.level + 0.5)
+
+
+'''
+QuizSessions
+    the quiz sessions of one application by token. They live in the
+    memory of the worker that opened them, so several workers need sticky
+    routing by session token. Sessions expire
+    QUIZ_SESSION_SECONDS after their last draw; expired ones are evicted
+    whenever a new session is opened.
+'''
+
+
+class QuizSessions:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def open(self, session):
+        token = secrets.token_urlsafe(16)
+        with self.lock:
+            self.evict()
+            self.sessions[token] = session
+        return token
+
+    def find(self, token):
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return None
+            if session.expires_at <= time.monotonic():
+                del self.sessions[token]
+                return None
+            session.touch()
+            return session
+
+    def close(self, token):
+        with self.lock:
+            return self.sessions.pop(token, None) is not None
+
+    def evict(self):
+        now = time.monotonic()
+        expired = [token for token, session in self.sessions.items()
+                   if session.expires_at <= now]
+        for token in expired:
+            del self.sessions[token]
+
+
+def get_quiz_sessions():
+    sessions = current_app.extensions.get('quiz_sessions')
+    if sessions is None:
+        sessions = QuizSessions()
+        current_app.extensions['quiz_sessions'] = sessions
+    return sessions
+
+
+'''
+open_quiz_session(category=None, adaptive=False, difficulty=1)
+    starts a quiz over the current questions of `category` (all categories
+    if None) and returns its token and the number of questions in it.
+    Adaptive quizzes start at `difficulty`. The number is an upper bound:
+    questions deleted later, or by other workers since the last refresh of
+    the sampler, are skipped when their turn comes.
+'''
+
+
+def open_quiz_session(category=None, adaptive=False,
+                      difficulty=QUIZ_MIN_DIFFICULTY):
+    sampler = get_sampler()
+    sampler.ensure_loaded()
+    pool = sampler.ids.get(category_key(category), array('l'))
+    deleted = sampler.deleted
+    if deleted:
+        # sessions share the sampler's array unless it holds deleted ids
+        pool = array('l', (
+            question_id for question_id in pool
+            if question_id not in deleted))
+    if adaptive:
+        session = AdaptiveQuizSession(category, len(pool), difficulty)
+    else:
+        session = QuizSession(pool)
+    return get_quiz_sessions().open(session), len(pool)
+
+
+def find_quiz_session(token):
+    return get_quiz_sessions().find(token)
+
+
+def close_quiz_session(token):
+    return get_quiz_sessions().close(token)
+
+
+'''
+next_session_question(session, correct=None)
+    returns the next QuestionRow of the session, or None at its end.
+    Questions deleted since the session started are skipped. `correct`
+    is the answer to the previous question, as reported by the client;
+    only adaptive quizzes use it.
+'''
+
+
+def next_session_question(session, correct=None):
+    sampler = get_sampler()
+    lock = get_quiz_sessions().lock
+
+    if isinstance(session, AdaptiveQuizSession):
+        with lock:
+            difficulty = session.next_difficulty(correct)
+        question = random_question(
+            session.category, session.asked, difficulty)
+        if question is not None:
+            with lock:
+                session.asked.add(question.id)
+        return question
+
+    while True:
+        with lock:
+            question_id = session.next_id()
+        if question_id is None:
+            return None
+        if question_id in sampler.deleted:
+            continue
+
+        question = QuestionRow.get(question_id)
+        if question is not None:
+            return question
@@ -0,0 +1,176 @@
+import threading
+import time
+from flask import current_app
+from sqlalchemy import func
+
+from models import db
+from models import Question
+from models import QuestionRow
+from models import on_question_write
+
+from .pagination import QUESTIONS_PER_PAGE
+
+SEARCH_REFRESH_SECONDS = 60
+
+'''
+Question search
+
+Search keeps the substring semantics of the original LIKE query, but is
+case-insensitive and ranked by trigram similarity to the search term.
+On Postgres it runs as ILIKE against the pg_trgm GIN index created by
+migrations/001_questions_search_index.sql. Other databases (SQLite in
+tests) use SearchIndex, an in-memory trigram inverted index kept current
+by the question write hooks.
+'''
+
+
+def trigrams(text):
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def similarity(grams, other_grams):
+    if not grams or not other_grams:
+        return 0.0
+    return len(grams & other_grams) / len(grams | other_grams)
+
+
+class SearchIndex:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.texts = {}
+        self.postings = {}
+        self.loaded_at = None
+
+    def load(self):
+        self.texts = {}
+        self.postings = {}
+        for question_id, text in db.session.query(
+                Question.id, Question.question):
+            self.add(question_id, text)
+        self.loaded_at = time.monotonic()
+
+    def expired(self):
+        return (self.loaded_at is None or
+                time.monotonic() - self.loaded_at >= SEARCH_REFRESH_SECONDS)
+
+    def ensure_loaded(self):
+        with self.lock:
+            if self.expired():
+                self.load()
+
+    def add(self, question_id, text):
+        text = (text or '').lower()
+        self.texts[question_id] = text
+        for gram in trigrams(text):
+            self.postings.setdefault(gram, set()).add(question_id)
+
+    def remove(self, question_id):
+        text = self.texts.pop(question_id, None)
+        if text is None:
+            return
+        for gram in trigrams(text):
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(question_id)
+                if not ids:
+                    del self.postings[gram]
+
+    def search(self, term):
+        needle = term.lower()
+        grams = trigrams(needle)
+
+        with self.lock:
+            if self.expired():
+                self.load()
+
+            if grams:
+                # intersect the rarest postings first
+                postings = sorted(
+                    (self.postings.get(gram, set()) for gram in grams),
+                    key=len)
+                candidates = set(postings[0]).intersection(*postings[1:])
+            else:
+                candidates = self.texts.keys()
+
+            # trigrams only narrow the candidates, the substring decides
+            scored = [
+                (-similarity(grams, trigrams(self.texts[question_id])),
+                 question_id)
+                for question_id in candidates
+                if needle in self.texts[question_id]]
+
+        scored.sort()
+        return [question_id for _, question_id in scored]
+
+
+def get_search_index():
+    index = current_app.extensions.get('search_index')
+    if index is None:
+        index = SearchIndex()
+        current_app.extensions['search_index'] = index
+    return index
+
+
+@on_question_write
+def update_search_index(action, questions):
+    index = current_app.extensions.get('search_index')
+    if index is None or index.loaded_at is None:
+        return
+
+    if action == 'bulk':
+        index.loaded_at = None
+        return
+
+    with index.lock:
+        for question in questions:
+            if action == 'insert':
+                index.add(question.id, question.question)
+            else:
+                index.remove(question.id)
+
+
+def escape_like(term):
+    return (term.replace('\\', '\\\\')
+            .replace('%', '\\%')
+            .replace('_', '\\_'))
+
+
+'''
+search_questions(term, page=1)
+    returns the formatted questions on `page` of the ranked matches
+    for `term`, and the number of matches overall.
+'''
+
+
+def search_questions(term, page=1):
+    if page < 1:
+        return [], 0
+    start = (page - 1) * QUESTIONS_PER_PAGE
+
+    if db.engine.dialect.name == 'postgresql':
+        matches = Question.question.ilike(
+            '%{}%'.format(escape_like(term)), escape='\\')
+        total_matches = (db.session.query(func.count(Question.id))
+                         .filter(matches)
+                         .scalar())
+        selection = (QuestionRow.query(matches)
+                     .order_by(func.similarity(Question.question, term)
+                               .desc(), Question.id)
+                     .offset(start)
+                     .limit(QUESTIONS_PER_PAGE)
+                     .all())
+        return [QuestionRow(*row).format() for row in selection], \
+            total_matches
+
+    matches = get_search_index().search(term)
+    page_ids = matches[start:start + QUESTIONS_PER_PAGE]
+    if not page_ids:
+        return [], len(matches)
+
+    questions = {
+        row.id: QuestionRow(*row) for row in
+        QuestionRow.query(Question.id.in_(page_ids)).all()}
+    return [questions[question_id].format() for question_id in page_ids
+            if question_id in questions], len(matches)
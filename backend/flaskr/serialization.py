@@ -0,0 +1,151 @@
+import gzip
+import json
+import time
+from flask import current_app
+from flask import request
+from flask.json import JSONEncoder
+
+from .metrics import record_timing
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_MIMETYPES = ('application/json', 'application/x-ndjson')
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+'''
+JSON responses
+
+jsonify(...) builds a JSON response like flask.jsonify, without pretty
+printing in debug mode, and records the time spent encoding it for the
+request instrumentation. The encoder is picked by JSON_SERIALIZER in the
+app config: 'orjson' (the default when orjson is installed), 'json' (the
+standard library, compact), or any function taking the data and
+sort_keys and returning bytes. Both honor JSON_SORT_KEYS; orjson always
+writes UTF-8 instead of \\u escapes.
+
+List endpoints send their questions in columns instead of objects when
+asked with ?shape=columns: {"id": [...], "question": [...], ...}, which
+saves repeating the keys of every question.
+
+JSON responses of at least COMPRESS_MIN_BYTES are compressed with brotli
+(when installed) or gzip, as accepted by the client; COMPRESS_MIN_BYTES =
+None in the app config turns compression off. Streamed responses and
+responses with an ETag are left alone. Compressing is counted in the
+serialization time.
+'''
+
+
+def stdlib_dumps(data, sort_keys):
+    return json.dumps(
+        data, cls=JSONEncoder, separators=(',', ':'), sort_keys=sort_keys,
+        ensure_ascii=current_app.config.get('JSON_AS_ASCII', True)) \
+        .encode('utf-8')
+
+
+def orjson_dumps(data, sort_keys):
+    option = orjson.OPT_NON_STR_KEYS
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    return orjson.dumps(data, default=JSONEncoder().default, option=option)
+
+
+SERIALIZERS = {'json': stdlib_dumps}
+if orjson is not None:
+    SERIALIZERS['orjson'] = orjson_dumps
+
+
+'''
+dumps(data)
+    encodes `data` as compact JSON bytes with the serializer of the app.
+'''
+
+
+def dumps(data):
+    serializer = current_app.config.get(
+        'JSON_SERIALIZER', 'orjson' if orjson is not None else 'json')
+    if not callable(serializer):
+        serializer = SERIALIZERS[serializer]
+    return serializer(data, current_app.config.get('JSON_SORT_KEYS', True))
+
+
+def jsonify(*args, **kwargs):
+    if args and kwargs:
+        raise TypeError(
+            'jsonify() behavior undefined when passed both args and kwargs')
+    data = args[0] if len(args) == 1 else args or kwargs
+
+    started = time.perf_counter()
+    response = current_app.response_class(
+        dumps(data) + b'\n',
+        mimetype=current_app.config.get('JSONIFY_MIMETYPE') or
+        'application/json')
+    record_timing('serialize_seconds', time.perf_counter() - started)
+    return response
+
+
+def wants_columns(request):
+    return request.args.get('shape') == 'columns'
+
+
+'''
+question_list(request, questions)
+    the formatted `questions` of a list endpoint in the shape asked for by
+    `request`: a list of objects, or one list per field.
+'''
+
+
+def question_list(request, questions):
+    if not wants_columns(request):
+        return questions
+    return {field: [question[field] for question in questions]
+            for field in QUESTION_FIELDS}
+
+
+def compress(response):
+    min_bytes = current_app.config.get(
+        'COMPRESS_MIN_BYTES', COMPRESS_MIN_BYTES)
+    if (min_bytes is None or response.is_streamed or
+            response.direct_passthrough or
+            response.status_code != 200 or
+            response.mimetype not in COMPRESS_MIMETYPES or
+            'Content-Encoding' in response.headers or
+            'ETag' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if response.calculate_content_length() < min_bytes:
+        return response
+
+    started = time.perf_counter()
+    if brotli is not None and request.accept_encodings['br']:
+        encoding = 'br'
+        body = brotli.compress(response.get_data(), quality=BROTLI_QUALITY)
+    elif request.accept_encodings['gzip']:
+        encoding = 'gzip'
+        body = gzip.compress(response.get_data(), GZIP_LEVEL)
+    else:
+        return response
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    record_timing('serialize_seconds', time.perf_counter() - started)
+    return response
+
+
+def init_compression(app):
+
+    @app.after_request
+    def compress_response(response):
+        return compress(response)
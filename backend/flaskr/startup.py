@@ -0,0 +1,80 @@
+import threading
+import time
+
+from config import warm_caches
+from models import db
+from models import create_schema
+from models import cached_categories
+
+from .quiz import get_sampler
+from .search import get_search_index
+from .stats import get_category_stats
+from .suggest import get_suggest_index
+
+'''
+Startup
+
+create_app only wires the routes; the database is touched by the schema
+check of models.setup_db (deferred to the first request with
+LAZY_DB_INIT = True) and by the in-memory caches, which are loaded by the
+first request that needs them. With WARM_CACHES = True in the app config
+(default from config.py) a background thread loads them right after
+startup instead: the categories, the category statistics, the quiz
+sampler and the search (except on Postgres, which searches in SQL) and
+suggest indexes. Requests arriving meanwhile
+are served as usual and wait on the lock of a cache being loaded.
+
+The phases are timed in app.extensions['startup_timings'] (seconds):
+    create_app  building the app, including the schema check unless lazy
+    schema      the schema check of models.create_schema
+    warm        loading the caches in the background
+and exported by GET /metrics as trivia_startup_seconds.
+'''
+
+
+def warm_search_index():
+    # Postgres searches with ILIKE on its trigram index; loading the
+    # in-memory index there would only make every write maintain it
+    if db.engine.dialect.name != 'postgresql':
+        get_search_index().ensure_loaded()
+
+
+CACHE_WARMERS = (
+    ('categories', cached_categories),
+    ('category_stats', lambda: get_category_stats().ensure_loaded()),
+    ('question_sampler', lambda: get_sampler().ensure_loaded()),
+    ('search_index', warm_search_index),
+    ('suggest_index', lambda: get_suggest_index().ensure_loaded()),
+    )
+
+
+def warm_app(app):
+    started = time.perf_counter()
+    with app.app_context():
+        try:
+            create_schema(app)
+            for name, warmer in CACHE_WARMERS:
+                warmer()
+        except Exception:
+            app.logger.exception('Warming the caches failed')
+        finally:
+            db.session.remove()
+    app.extensions['startup_timings']['warm'] = time.perf_counter() - started
+
+
+'''
+finish_startup(app, started)
+    records the time create_app took since `started` (a perf_counter
+    value) and starts warming the caches when enabled.
+'''
+
+
+def finish_startup(app, started):
+    timings = app.extensions.setdefault('startup_timings', {})
+    timings['create_app'] = time.perf_counter() - started
+
+    if app.config.get('WARM_CACHES', warm_caches):
+        thread = threading.Thread(
+            target=warm_app, args=(app,), name='warm-caches', daemon=True)
+        app.extensions['warm_thread'] = thread
+        thread.start()
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import Counter
+from flask import current_app
+from sqlalchemy import func
+
+from models import db
+from models import Question
+from models import on_question_write
+
+from .store import current_snapshot
+
+STATS_REFRESH_SECONDS = 60
+
+'''
+CategoryStats
+    keeps the number of questions per category and difficulty, so that
+    totals and histograms are answered in O(categories) without touching
+    the questions table. It is loaded with one GROUP BY query (or counted
+    from the shared question store, when enabled), adjusted by
+    the inserts and deletes of this worker once they are committed, and
+    reloaded every STATS_REFRESH_SECONDS to pick up writes of other workers.
+'''
+
+
+class CategoryStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.loaded_at = None
+
+    def load(self):
+        counts = {}
+        snapshot = current_snapshot()
+        if snapshot is not None:
+            rows = [key + (count,) for key, count in Counter(
+                (category, difficulty)
+                for _, category, difficulty in snapshot.columns()).items()]
+        else:
+            rows = (db.session.query(
+                        Question.category, Question.difficulty,
+                        func.count(Question.id))
+                    .group_by(Question.category, Question.difficulty))
+        for category, difficulty, count in rows:
+            counts.setdefault(category, {})[difficulty] = count
+
+        self.counts = counts
+        self.loaded_at = time.monotonic()
+
+    def expired(self):
+        return (self.loaded_at is None or
+                time.monotonic() - self.loaded_at >= STATS_REFRESH_SECONDS)
+
+    def ensure_loaded(self):
+        if not self.expired():
+            return
+        with self.lock:
+            if self.expired():
+                self.load()
+
+    def add(self, category, difficulty, change):
+        if self.loaded_at is None:
+            return
+        with self.lock:
+            histogram = self.counts.setdefault(category, {})
+            count = histogram.get(difficulty, 0) + change
+            if count > 0:
+                histogram[difficulty] = count
+            else:
+                histogram.pop(difficulty, None)
+                if not histogram:
+                    del self.counts[category]
+
+    def total(self, category=None):
+        self.ensure_loaded()
+        if category is not None:
+            return sum(self.counts.get(category, {}).values())
+        return sum(sum(histogram.values())
+                   for histogram in self.counts.values())
+
+    def histogram(self, category):
+        self.ensure_loaded()
+        # questions without a difficulty are counted last
+        return dict(sorted(
+            self.counts.get(category, {}).items(),
+            key=lambda item: (item[0] is None, item[0] or 0)))
+
+
+def get_category_stats():
+    stats = current_app.extensions.get('category_stats')
+    if stats is None:
+        stats = CategoryStats()
+        current_app.extensions['category_stats'] = stats
+    return stats
+
+
+'''
+category_summary(categories)
+    returns the number of questions and the difficulty histogram of each
+    category of `categories` (ids to types), keyed by category id. The
+    histogram is keyed by the difficulties as JSON writes them, "null"
+    for questions without one, so that it encodes with sorted keys.
+'''
+
+
+def category_summary(categories):
+    stats = get_category_stats()
+    return {
+        category_id: {
+            'type': category_type,
+            'total_questions': stats.total(category_id),
+            'difficulties': {
+                'null' if difficulty is None else str(difficulty): count
+                for difficulty, count
+                in stats.histogram(category_id).items()}
+            }
+        for category_id, category_type in categories.items()}
+
+
+@on_question_write
+def update_category_stats(action, questions):
+    stats = current_app.extensions.get('category_stats')
+    if stats is None:
+        return
+
+    if action == 'bulk':
+        stats.loaded_at = None
+        return
+
+    change = 1 if action == 'insert' else -1
+    for question in questions:
+        stats.add(question.category, question.difficulty, change)
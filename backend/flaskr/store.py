@@ -0,0 +1,469 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from bisect import insort
+from contextlib import contextmanager
+from datetime import datetime
+from datetime import timedelta
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy import select
+
+from config import question_store
+from models import db
+from models import Question
+from models import QuestionRow
+from models import question_changes
+from models import on_question_write
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+STORE_POLL_SECONDS = 1
+STORE_REBUILD_SECONDS = 60 * 60
+STORE_CHANGE_WINDOW = 1000
+STORE_CHANGE_RETENTION = timedelta(days=1)
+STORE_BATCH_SIZE = 1000
+STORE_SLACK_BYTES = 1 << 20
+
+STORE_MAGIC = b'TRVQ'
+STORE_FORMAT = 1
+HEADER = struct.Struct('<4sIqqqdqq')
+HEADER_SIZE = 64
+NULL = -0x80000000
+
+'''
+Shared question store
+
+With QUESTION_STORE set to a file path in the app config (default from
+config.py), the question listings and quizzes are served from a snapshot
+of the questions table in that file instead of the database. The file is
+memory-mapped read-only, so all workers of a host share one copy of it in
+the page cache. It is column-oriented:
+
+    header        row counts, last applied change, time of the last rebuild
+    ids           int64, ascending
+    categories    int32 (NULL for none)
+    difficulties  int32 (NULL for none)
+    question_at, question_length, answer_at, answer_length
+                  where the UTF-8 texts of every row are in the text heap
+    by_category   int64 ids of the questions with a category, ordered by
+                  (category, id)
+    text heap     the question and answer texts
+    meta          JSON: the range of every category in by_category, the
+                  recently applied change ids and the bytes of live text
+
+Writes append the ids of the questions they touched to the
+question_changes table (a write hook, after the commit). At most every
+STORE_POLL_SECONDS per host, one worker reads the new changes, re-reads
+those questions, and writes a new snapshot next to the old one which
+replaces it atomically; the other workers map the new file when they
+notice it. An update copies the unchanged runs of every column and the
+whole text heap in bulk, and appends the texts of the changed questions
+to the heap. The worker that wrote a question refreshes right away, so it
+reads its own writes.
+
+Changes are re-read over a window of STORE_CHANGE_WINDOW ids, because log
+ids may commit out of order. The snapshot is rebuilt from the table every
+STORE_REBUILD_SECONDS, after bulk writes and when more than half of the
+heap is dead text; old changes are pruned then.
+'''
+
+ROW_COLUMNS = (
+    ('ids', 'q'),
+    ('categories', 'i'),
+    ('difficulties', 'i'),
+    ('question_at', 'Q'),
+    ('question_length', 'I'),
+    ('answer_at', 'Q'),
+    ('answer_length', 'I'))
+
+
+def nullable(value):
+    return None if value == NULL else value
+
+
+def encode(row):
+    question_id, question, answer, category, difficulty = row
+    return (question_id, (question or '').encode('utf-8'),
+            (answer or '').encode('utf-8'), category, difficulty)
+
+
+'''
+SnapshotBuilder(heap=b'')
+    collects the rows of a new snapshot, in id order, on top of the text
+    heap of the previous one, and writes them out.
+'''
+
+
+class SnapshotBuilder:
+
+    def __init__(self, heap=b''):
+        for name, typecode in ROW_COLUMNS:
+            setattr(self, name, array(typecode))
+        self.heap = heap
+        self.texts = bytearray()
+        self.live_bytes = 0
+
+    def append_text(self, text, offsets, lengths):
+        offsets.append(len(self.heap) + len(self.texts))
+        lengths.append(len(text))
+        self.texts += text
+        self.live_bytes += len(text)
+
+    def add(self, question_id, question, answer, category, difficulty):
+        self.ids.append(question_id)
+        self.categories.append(NULL if category is None else category)
+        self.difficulties.append(NULL if difficulty is None else difficulty)
+        self.append_text(question, self.question_at, self.question_length)
+        self.append_text(answer, self.answer_at, self.answer_length)
+
+    def extend(self, snapshot, start, end):
+        if start >= end:
+            return
+        for name, _ in ROW_COLUMNS:
+            getattr(self, name).frombytes(
+                getattr(snapshot, name)[start:end].cast('B'))
+
+    def by_category(self):
+        order = sorted(
+            (position for position in range(len(self.ids))
+             if self.categories[position] != NULL),
+            key=self.categories.__getitem__)
+        by_category = array('q', [self.ids[position] for position in order])
+        category_ranges = {}
+        for index, position in enumerate(order):
+            category_ranges.setdefault(
+                self.categories[position], [index, index])[1] = index + 1
+        return by_category, category_ranges
+
+    def write(self, path, by_category, category_ranges, last_change,
+              rebuilt_at, recent_changes):
+        meta = json.dumps({
+            'category_ranges': {
+                str(category): list(bounds)
+                for category, bounds in category_ranges.items()},
+            'recent_changes': sorted(recent_changes),
+            'live_bytes': self.live_bytes
+            }).encode('utf-8')
+
+        descriptor, temporary = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)),
+            prefix='.trivia-store-')
+        try:
+            with os.fdopen(descriptor, 'wb') as output:
+                output.write(HEADER.pack(
+                    STORE_MAGIC, STORE_FORMAT, len(self.ids),
+                    len(by_category), last_change, rebuilt_at,
+                    len(self.heap) + len(self.texts), len(meta)).ljust(
+                        HEADER_SIZE, b'\0'))
+                for name, _ in ROW_COLUMNS:
+                    output.write(getattr(self, name))
+                    output.write(b'\0' * (-output.tell() % 8))
+                output.write(by_category)
+                output.write(self.heap)
+                output.write(self.texts)
+                output.write(b'\0' * (-output.tell() % 8))
+                output.write(meta)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+
+class Snapshot:
+
+    def __init__(self, path):
+        with open(path, 'rb') as source:
+            self.inode = os.fstat(source.fileno()).st_ino
+            self.buffer = mmap.mmap(
+                source.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.count, by_category_count, self.last_change,
+         self.rebuilt_at, heap_bytes, meta_bytes) = \
+            HEADER.unpack_from(self.buffer)
+        if magic != STORE_MAGIC or version != STORE_FORMAT:
+            raise ValueError('{} is not a question store'.format(path))
+
+        view = memoryview(self.buffer)
+        offset = HEADER_SIZE
+        for name, typecode in ROW_COLUMNS + (('by_category', 'q'),):
+            length = by_category_count if name == 'by_category' \
+                else self.count
+            size = length * struct.calcsize(typecode)
+            setattr(self, name, view[offset:offset + size].cast(typecode))
+            offset += size + (-size % 8)
+        self.heap_at = offset
+        self.heap = view[offset:offset + heap_bytes]
+        offset += heap_bytes + (-heap_bytes % 8)
+
+        meta = json.loads(
+            self.buffer[offset:offset + meta_bytes].decode('utf-8'))
+        self.category_ranges = {
+            int(category): tuple(bounds)
+            for category, bounds in meta['category_ranges'].items()}
+        self.recent_changes = set(meta['recent_changes'])
+        self.live_bytes = meta['live_bytes']
+
+    def __len__(self):
+        return self.count
+
+    def text(self, offset, length):
+        start = self.heap_at + offset
+        return self.buffer[start:start + length].decode('utf-8')
+
+    def position(self, question_id):
+        position = bisect_left(self.ids, question_id)
+        if position < self.count and self.ids[position] == question_id:
+            return position
+        return None
+
+    def row(self, position):
+        return QuestionRow(
+            self.ids[position],
+            self.text(self.question_at[position],
+                      self.question_length[position]),
+            self.text(self.answer_at[position],
+                      self.answer_length[position]),
+            nullable(self.categories[position]),
+            nullable(self.difficulties[position]))
+
+    '''
+    ids_of(category=None)
+        the ascending ids of the questions of `category` (of all
+        questions if None), as a sequence which can be sliced and bisected.
+    '''
+    def ids_of(self, category=None):
+        if category is None:
+            return self.ids
+        start, end = self.category_ranges.get(category, (0, 0))
+        return self.by_category[start:end]
+
+    def rows(self, question_ids):
+        rows = {}
+        for question_id in question_ids:
+            position = self.position(question_id)
+            if position is not None:
+                rows[question_id] = self.row(position)
+        return rows
+
+    def columns(self):
+        for question_id, category, difficulty in zip(
+                self.ids, self.categories, self.difficulties):
+            yield question_id, nullable(category), nullable(difficulty)
+
+
+@contextmanager
+def host_lock(path):
+    with open(path, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class QuestionStore:
+
+    def __init__(self, path, poll_seconds=STORE_POLL_SECONDS):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.poll_seconds = poll_seconds
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.checked_at = None
+
+    def expired(self):
+        return (self.checked_at is None or
+                time.monotonic() - self.checked_at >= self.poll_seconds)
+
+    def current(self):
+        if self.expired():
+            with self.lock:
+                if self.expired():
+                    self.refresh()
+        return self.snapshot
+
+    '''
+    refresh(force=False)
+        maps the newest snapshot file of the host, and applies the new
+        changes to it unless another worker polled the change log less
+        than poll_seconds ago. The caller holds self.lock.
+    '''
+    def refresh(self, force=False):
+        with host_lock(self.lock_path):
+            snapshot = self.open_latest()
+            polled_at = os.path.getmtime(self.lock_path)
+            if (snapshot is None or force or
+                    time.time() - polled_at >= self.poll_seconds):
+                snapshot = self.update(snapshot)
+                os.utime(self.lock_path)
+            self.snapshot = snapshot
+        self.checked_at = time.monotonic()
+
+    def open_latest(self):
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return None
+        if self.snapshot is not None and self.snapshot.inode == inode:
+            return self.snapshot
+        try:
+            return Snapshot(self.path)
+        except ValueError:
+            return None
+
+    def update(self, snapshot):
+        if (snapshot is None or
+                time.time() - snapshot.rebuilt_at >= STORE_REBUILD_SECONDS):
+            return self.rebuild()
+
+        changes = [
+            (change_id, question_id)
+            for change_id, question_id in db.session.execute(
+                select([question_changes.c.id, question_changes.c.question_id])
+                .where(question_changes.c.id >
+                       snapshot.last_change - STORE_CHANGE_WINDOW)
+                .order_by(question_changes.c.id))
+            if change_id not in snapshot.recent_changes]
+        if not changes:
+            return snapshot
+        if any(question_id is None for _, question_id in changes):
+            return self.rebuild()
+
+        changed = sorted({question_id for _, question_id in changes})
+        rows = {row[0]: encode(row) for row in
+                QuestionRow.query(Question.id.in_(changed))}
+
+        # copy the runs between the changed ids, drop their old rows and
+        # add their current ones; note which categories they touch
+        builder = SnapshotBuilder(snapshot.heap)
+        builder.live_bytes = snapshot.live_bytes
+        removed = {}
+        added = {}
+        position = 0
+        for question_id in changed:
+            found = bisect_left(snapshot.ids, question_id, position)
+            builder.extend(snapshot, position, found)
+            position = found
+            if snapshot.position(question_id) == found:
+                builder.live_bytes -= (snapshot.question_length[found] +
+                                       snapshot.answer_length[found])
+                removed.setdefault(
+                    snapshot.categories[found], set()).add(question_id)
+                position += 1
+            if question_id in rows:
+                builder.add(*rows[question_id])
+                added.setdefault(
+                    builder.categories[-1], []).append(question_id)
+        builder.extend(snapshot, position, snapshot.count)
+
+        if (len(builder.heap) + len(builder.texts) >
+                2 * builder.live_bytes + STORE_SLACK_BYTES):
+            return self.rebuild()
+
+        by_category = array('q')
+        category_ranges = {}
+        for category in sorted(set(snapshot.category_ranges) | set(added)):
+            if category == NULL:
+                continue
+            ids = snapshot.ids_of(category)
+            start = len(by_category)
+            if category in removed or category in added:
+                ids = [question_id for question_id in ids
+                       if question_id not in removed.get(category, ())]
+                for question_id in added.get(category, ()):
+                    insort(ids, question_id)
+                by_category.extend(ids)
+            else:
+                by_category.frombytes(ids.cast('B'))
+            if len(by_category) > start:
+                category_ranges[category] = (start, len(by_category))
+
+        last_change = max(snapshot.last_change, changes[-1][0])
+        recent_changes = [
+            change_id for change_id in
+            snapshot.recent_changes.union(
+                change_id for change_id, _ in changes)
+            if change_id > last_change - STORE_CHANGE_WINDOW]
+
+        builder.write(self.path, by_category, category_ranges, last_change,
+                      snapshot.rebuilt_at, recent_changes)
+        return Snapshot(self.path)
+
+    def rebuild(self):
+        rebuilt_at = time.time()
+        db.session.execute(question_changes.delete().where(
+            question_changes.c.changed_at <
+            datetime.utcnow() - STORE_CHANGE_RETENTION))
+        last_change = db.session.query(
+            func.max(question_changes.c.id)).scalar() or 0
+        recent_changes = [
+            change_id for change_id, in db.session.execute(
+                select([question_changes.c.id]).where(
+                    question_changes.c.id >
+                    last_change - STORE_CHANGE_WINDOW))]
+
+        builder = SnapshotBuilder()
+        for row in (QuestionRow.query().order_by(Question.id)
+                    .yield_per(STORE_BATCH_SIZE)):
+            builder.add(*encode(row))
+        by_category, category_ranges = builder.by_category()
+        builder.write(self.path, by_category, category_ranges, last_change,
+                      rebuilt_at, recent_changes)
+        db.session.commit()
+        return Snapshot(self.path)
+
+
+def get_question_store():
+    path = current_app.config.get('QUESTION_STORE', question_store)
+    if not path:
+        return None
+
+    store = current_app.extensions.get('question_store')
+    if store is None:
+        store = QuestionStore(path, current_app.config.get(
+            'QUESTION_STORE_POLL_SECONDS', STORE_POLL_SECONDS))
+        current_app.extensions['question_store'] = store
+    return store
+
+
+'''
+current_snapshot()
+    returns the current Snapshot of the shared question store, or None
+    when the store is disabled.
+'''
+
+
+def current_snapshot():
+    store = get_question_store()
+    return store.current() if store is not None else None
+
+
+@on_question_write
+def log_question_changes(action, questions):
+    store = get_question_store()
+    if store is None:
+        return
+
+    if action == 'bulk':
+        changed = [None]
+    else:
+        changed = [question.id for question in questions]
+    db.session.execute(question_changes.insert(), [
+        {'question_id': question_id} for question_id in changed])
+    db.session.commit()
+
+    with store.lock:
+        if store.snapshot is not None:
+            store.refresh(force=True)
@@ -0,0 +1,83 @@
+from flask import Response
+from flask import stream_with_context
+
+from models import Question
+from models import QuestionRow
+
+from .serialization import QUESTION_FIELDS
+from .serialization import dumps
+
+STREAM_BATCH_SIZE = 1000
+
+'''
+Streaming responses
+
+Listings can be requested in full as a stream with `?stream=1` (one JSON
+document) or `Accept: application/x-ndjson` (one question per line).
+Rows are read as plain tuples through a server side cursor, STREAM_BATCH_SIZE
+at a time, encoded with the JSON serializer of flaskr/serialization.py and
+written out as they arrive, so memory stays flat however many questions
+are listed.
+'''
+
+
+def wants_stream(request):
+    return (request.args.get('stream', 0, type=int) == 1 or
+            request.accept_mimetypes.best == 'application/x-ndjson')
+
+
+'''
+question_rows(*criteria)
+    iterates over (id, question, answer, category, difficulty) tuples of
+    the questions matching `criteria`, ordered by id.
+'''
+
+
+def question_rows(*criteria):
+    return (QuestionRow.query(*criteria)
+            .order_by(Question.id)
+            .execution_options(stream_results=True)
+            .yield_per(STREAM_BATCH_SIZE))
+
+
+def ndjson_chunks(rows):
+    lines = []
+    for row in rows:
+        lines.append(dumps(dict(zip(QUESTION_FIELDS, row))).decode('utf-8'))
+        if len(lines) == STREAM_BATCH_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def json_document_chunks(rows, fields):
+    head = dumps(fields).decode('utf-8')
+    yield head[:-1] + (',' if fields else '') + '"questions":['
+
+    separator = ''
+    for chunk in ndjson_chunks(rows):
+        yield separator + chunk.rstrip('\n').replace('\n', ',')
+        separator = ','
+
+    yield ']}'
+
+
+'''
+stream_questions(request, criteria, **fields)
+    streams the questions matching `criteria` in the format asked for by
+    `request`; `fields` are the other keys of the JSON document.
+'''
+
+
+def stream_questions(request, criteria, **fields):
+    rows = question_rows(*criteria)
+
+    if request.accept_mimetypes.best == 'application/x-ndjson':
+        return Response(
+            stream_with_context(ndjson_chunks(rows)),
+            mimetype='application/x-ndjson')
+
+    return Response(
+        stream_with_context(json_document_chunks(rows, fields)),
+        mimetype='application/json')
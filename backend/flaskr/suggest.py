@@ -0,0 +1,239 @@
+import heapq
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from bisect import insort
+from flask import current_app
+
+from models import db
+from models import Question
+from models import on_question_write
+
+SUGGEST_REFRESH_SECONDS = 60
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 20
+SUGGEST_MIN_PREFIX = 2
+SUGGEST_MAX_AGE = 30
+
+WORD = re.compile(r'\w+')
+
+'''
+Search-as-you-type
+
+SuggestIndex maps every word of the question texts to the questions that
+contain it, and keeps the words in a sorted list, so that the words
+starting with a prefix are one bisect away. Each posting is an array of
+(length << 32 | id) keys in ascending order: merging the postings of the
+matching words yields the shortest matching questions first, and
+suggest() stops as soon as it has `limit` of them.
+
+The last word of a query is a prefix, earlier words must match whole
+words. Inserts and deletes of this worker patch the index in place; it is
+rebuilt every SUGGEST_REFRESH_SECONDS to pick up writes of other workers.
+'''
+
+
+def words(text):
+    return set(WORD.findall((text or '').lower()))
+
+
+def rank_key(question_id, text):
+    return min(len(text or ''), 0x7fffffff) << 32 | question_id
+
+
+def contains(posting, key):
+    position = bisect_left(posting, key)
+    return position < len(posting) and posting[position] == key
+
+
+'''
+intersect(postings)
+    yields the keys found in all of the sorted arrays `postings`, in
+    order, bisecting from one array to the next so that long runs of
+    keys missing from the others are skipped.
+'''
+
+
+def intersect(postings):
+    if not postings or not all(postings):
+        return
+    positions = [0] * len(postings)
+    key = postings[0][0]
+    matched = 0
+    index = 0
+    while True:
+        posting = postings[index]
+        position = bisect_left(posting, key, positions[index])
+        if position == len(posting):
+            return
+        positions[index] = position
+        if posting[position] != key:
+            key = posting[position]
+            matched = 0
+        matched += 1
+        if matched == len(postings):
+            yield key
+            key += 1
+            matched = 0
+        index = (index + 1) % len(postings)
+
+
+class SuggestIndex:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.texts = {}
+        self.postings = {}
+        self.vocabulary = []
+        self.loaded_at = None
+
+    def load(self):
+        self.texts = {}
+        postings = {}
+        for question_id, text in db.session.query(
+                Question.id, Question.question):
+            self.texts[question_id] = text
+            key = rank_key(question_id, text)
+            for word in words(text):
+                postings.setdefault(word, []).append(key)
+
+        self.postings = {
+            word: array('q', sorted(keys)) for word, keys in postings.items()}
+        self.vocabulary = sorted(self.postings)
+        self.loaded_at = time.monotonic()
+
+    def expired(self):
+        return (self.loaded_at is None or
+                time.monotonic() - self.loaded_at >= SUGGEST_REFRESH_SECONDS)
+
+    def ensure_loaded(self):
+        with self.lock:
+            if self.expired():
+                self.load()
+
+    def add(self, question_id, text):
+        self.texts[question_id] = text
+        key = rank_key(question_id, text)
+        for word in words(text):
+            posting = self.postings.get(word)
+            if posting is None:
+                self.postings[word] = array('q', [key])
+                insort(self.vocabulary, word)
+            else:
+                insort(posting, key)
+
+    def remove(self, question_id):
+        text = self.texts.pop(question_id, None)
+        if text is None:
+            return
+        key = rank_key(question_id, text)
+        for word in words(text):
+            posting = self.postings.get(word)
+            if posting is None:
+                continue
+            if contains(posting, key):
+                del posting[bisect_left(posting, key)]
+            if not posting:
+                del self.postings[word]
+                del self.vocabulary[bisect_left(self.vocabulary, word)]
+
+    def prefix_words(self, prefix):
+        vocabulary = self.vocabulary
+        position = bisect_left(vocabulary, prefix)
+        while (position < len(vocabulary) and
+               vocabulary[position].startswith(prefix)):
+            yield vocabulary[position]
+            position += 1
+
+    def suggest(self, query, limit=SUGGEST_LIMIT):
+        query_words = WORD.findall(query.lower())
+        if not query_words:
+            return []
+        whole_words, prefix = set(query_words[:-1]), query_words[-1]
+        if len(prefix) < SUGGEST_MIN_PREFIX and not whole_words:
+            return []
+
+        with self.lock:
+            if self.expired():
+                self.load()
+
+            if any(word not in self.postings for word in whole_words):
+                return []
+
+            prefix_postings = [
+                self.postings[word] for word in self.prefix_words(prefix)]
+            whole_postings = sorted(
+                (self.postings[word] for word in whole_words), key=len)
+
+            # one prefix word: leapfrog over the sorted postings; more:
+            # walk whichever side is smaller, the questions with a word
+            # starting with the prefix, checking the whole words by bisect,
+            # or the rarest whole word, checking the prefix on the text
+            walk_whole = False
+            if len(prefix_postings) == 1:
+                keys = intersect(whole_postings + prefix_postings)
+                whole_postings = []
+            elif whole_postings and len(whole_postings[0]) < \
+                    sum(len(posting) for posting in prefix_postings):
+                walk_whole = True
+                keys = whole_postings[0]
+            else:
+                keys = heapq.merge(*prefix_postings)
+
+            matches = []
+            last_key = None
+            for key in keys:
+                if key == last_key:
+                    continue
+                last_key = key
+                if not all(contains(posting, key)
+                           for posting in whole_postings):
+                    continue
+                question_id = key & 0xffffffff
+                text = self.texts[question_id]
+                if walk_whole and not any(
+                        word.startswith(prefix) for word in words(text)):
+                    continue
+                matches.append({'id': question_id, 'question': text})
+                if len(matches) == limit:
+                    break
+        return matches
+
+
+def get_suggest_index():
+    index = current_app.extensions.get('suggest_index')
+    if index is None:
+        index = SuggestIndex()
+        current_app.extensions['suggest_index'] = index
+    return index
+
+
+'''
+suggest_questions(query, limit=SUGGEST_LIMIT)
+    returns the ids and texts of up to `limit` questions matching `query`
+    as typed so far, shortest first.
+'''
+
+
+def suggest_questions(query, limit=SUGGEST_LIMIT):
+    return get_suggest_index().suggest(query, limit)
+
+
+@on_question_write
+def update_suggest_index(action, questions):
+    index = current_app.extensions.get('suggest_index')
+    if index is None or index.loaded_at is None:
+        return
+
+    if action == 'bulk':
+        index.loaded_at = None
+        return
+
+    with index.lock:
+        for question in questions:
+            if action == 'insert':
+                index.add(question.id, question.question)
+            else:
+                index.remove(question.id)
@@ -0,0 +1,175 @@
+import json
+import random
+from itertools import accumulate
+from types import SimpleNamespace
+import click
+from flask import current_app
+
+from models import db
+from models import create_schema
+from models import Category
+from models import notify_category_write
+from models import notify_question_write
+
+from .bulk import insert_batch
+
+GENERATE_BATCH_SIZE = 10000
+
+CATEGORY_TYPES = (
+    'Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports')
+
+DIFFICULTY_WEIGHTS = (15, 30, 30, 17, 8)
+
+QUESTION_TEMPLATES = (
+    'What is the {} of the {}?',
+    'Which {} is known as the {}?',
+    'Who first described the {} {}?',
+    'In which year did the {} reach the {}?',
+    'How many {} are there in the {}?',
+    'What do the {} and the {} have in common?',
+    )
+
+WORDS = (
+    'river', 'mountain', 'painter', 'planet', 'empire', 'novel', 'king',
+    'queen', 'bridge', 'element', 'island', 'composer', 'ocean', 'battle',
+    'treaty', 'desert', 'capital', 'forest', 'symphony', 'player', 'team',
+    'stadium', 'record', 'film', 'actor', 'director', 'series', 'album',
+    'song', 'band', 'museum', 'statue', 'temple', 'city', 'country',
+    'continent', 'volcano', 'lake', 'glacier', 'comet', 'galaxy', 'star',
+    'moon', 'atom', 'molecule', 'cell', 'gene', 'protein', 'bone', 'organ',
+    'inventor', 'machine', 'engine', 'railway', 'ship', 'voyage', 'explorer',
+    'dynasty', 'revolution', 'republic', 'parliament', 'language',
+    'alphabet', 'poem', 'poet', 'sculptor', 'portrait', 'cathedral',
+    'castle', 'tower', 'harbor', 'canal', 'border', 'mineral', 'metal',
+    'crystal', 'species', 'mammal', 'bird', 'insect', 'reptile', 'tree',
+    'flower', 'season', 'tournament', 'medal', 'champion', 'coach', 'goal',
+    'league', 'race', 'marathon', 'theater', 'opera', 'ballet', 'festival',
+    'legend', 'myth', 'hero', 'villain', 'character', 'author', 'chapter',
+    'theory', 'equation', 'telescope', 'satellite', 'mission', 'rocket',
+    'ancient', 'modern', 'famous', 'largest', 'smallest', 'oldest',
+    'longest', 'highest', 'deepest', 'first', 'last', 'northern',
+    'southern', 'eastern', 'western', 'golden', 'silver', 'royal', 'secret',
+    )
+
+'''
+Synthetic question banks
+
+QuestionGenerator(categories, seed=0, skew=1.2) yields realistic-looking
+questions for the category ids in `categories`: categories are picked
+with Zipf-like weights (the first is the most frequent, `skew` = 0 spreads
+them evenly), question texts vary from a handful to several dozen words,
+answers from one to a few, and difficulties lean to the middle. The same
+seed always gives the same questions.
+'''
+
+
+class QuestionGenerator:
+
+    def __init__(self, categories, seed=0, skew=1.2):
+        self.random = random.Random(seed)
+        self.categories = list(categories)
+        self.category_weights = list(accumulate(
+            1 / rank ** skew for rank in range(1, len(self.categories) + 1)))
+        self.difficulty_weights = list(accumulate(DIFFICULTY_WEIGHTS))
+
+    def words(self, count):
+        return ' '.join(self.random.choice(WORDS) for _ in range(count))
+
+    def question(self):
+        # lengths are log-normal: mostly short, with a long tail
+        length = min(max(int(self.random.lognormvariate(1.6, 0.7)), 1), 60)
+        template = self.random.choice(QUESTION_TEMPLATES)
+        text = template.format(self.words(length), self.words(1))
+        if self.random.random() < 0.1:
+            text += ' ' + self.words(self.random.randint(20, 80)) + '.'
+        return text[0].upper() + text[1:]
+
+    def answer(self):
+        length = min(int(self.random.expovariate(0.8)) + 1, 6)
+        return self.words(length).title()
+
+    def rows(self, count):
+        choices = self.random.choices
+        for _ in range(count):
+            yield {
+                'question': self.question(),
+                'answer': self.answer(),
+                'category': choices(
+                    self.categories, cum_weights=self.category_weights)[0],
+                'difficulty': choices(
+                    range(1, 6), cum_weights=self.difficulty_weights)[0]
+                }
+
+
+'''
+ensure_categories(count)
+    returns the ids of the first `count` categories, creating the missing
+    ones (the categories of trivia.psql first, then "Category <n>").
+'''
+
+
+def ensure_categories(count):
+    existing = [category_id for category_id, in
+                db.session.query(Category.id).order_by(Category.id)]
+    if len(existing) < count:
+        db.session.execute(Category.__table__.insert(), [
+            {'type': (CATEGORY_TYPES[number - 1]
+                      if number <= len(CATEGORY_TYPES)
+                      else 'Category {}'.format(number))}
+            for number in range(len(existing) + 1, count + 1)])
+        db.session.commit()
+        notify_category_write('insert', [])
+        return ensure_categories(count)
+    return existing[:count]
+
+
+'''
+generate_questions(count, seed=0, skew=1.2, categories=6,
+                   batch_size=GENERATE_BATCH_SIZE)
+    inserts `count` synthetic questions over `categories` categories in
+    batches of `batch_size` rows (COPY on Postgres, executemany elsewhere)
+    and returns the number of questions per category.
+'''
+
+
+def generate_questions(count, seed=0, skew=1.2, categories=6,
+                       batch_size=GENERATE_BATCH_SIZE):
+    generator = QuestionGenerator(ensure_categories(categories), seed, skew)
+    counts = {}
+    batch = []
+
+    def flush():
+        insert_batch(batch)
+        db.session.commit()
+        batch.clear()
+
+    for row in generator.rows(count):
+        batch.append(row)
+        counts[row['category']] = counts.get(row['category'], 0) + 1
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    notify_question_write('bulk', [
+        SimpleNamespace(id=None, category=category) for category in counts])
+    return counts
+
+
+def init_generate_command(app):
+
+    @app.cli.command('generate-questions')
+    @click.argument('count', type=int)
+    @click.option('--seed', default=0)
+    @click.option('--skew', default=1.2)
+    @click.option('--categories', default=len(CATEGORY_TYPES))
+    @click.option('--batch-size', default=GENERATE_BATCH_SIZE)
+    def generate_questions_command(count, seed, skew, categories,
+                                   batch_size):
+        '''Insert COUNT synthetic questions, the same ones for a seed.'''
+        create_schema(current_app)
+        counts = generate_questions(
+            count, seed, skew, categories, batch_size)
+        click.echo(json.dumps(
+            {str(category): number
+             for category, number in sorted(counts.items())}, indent=2))
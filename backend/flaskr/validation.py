@@ -0,0 +1,50 @@
+'''
+validate_question(body, categories)
+    checks the fields of a new question as sent to POST /questions or
+    in a bulk import row, and returns them ready for the questions table.
+    `categories` holds the ids of the existing categories, for example
+    cached_categories()['categories']. Raises ValueError with a message
+    for the client on the first problem.
+'''
+
+
+def validate_question(body, categories):
+    new_question = body.get('question', None)
+    new_answer = body.get('answer', None)
+    new_category = body.get('category', None)
+    new_difficulty = body.get('difficulty', None)
+
+    if not new_question:
+        raise ValueError('Fill Question Field')
+
+    if not new_answer:
+        raise ValueError('Fill Answer Field')
+
+    if not isinstance(new_question, str) or not new_question.strip():
+        raise ValueError('Question must be text')
+
+    if not isinstance(new_answer, str) or not new_answer.strip():
+        raise ValueError('Answer must be text')
+
+    if not new_category:
+        raise ValueError('Fill Category Field')
+
+    if not new_difficulty:
+        raise ValueError('Fill Difficulty Field')
+
+    if not str(new_category).isdigit():
+        raise ValueError('Category must be a category id')
+
+    if not str(new_difficulty).isdigit():
+        raise ValueError('Difficulty must be a number')
+
+    if int(new_category) not in categories:
+        raise ValueError(
+            'Category {} does not exist'.format(int(new_category)))
+
+    return {
+        'question': new_question,
+        'answer': new_answer,
+        'category': int(new_category),
+        'difficulty': int(new_difficulty)
+        }
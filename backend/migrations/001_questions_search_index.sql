@@ -0,0 +1,9 @@
+--
+-- Trigram index backing the case-insensitive question search
+-- of POST /questions (see flaskr/search.py).
+--
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS questions_question_trgm_idx
+    ON public.questions USING gin (question gin_trgm_ops);
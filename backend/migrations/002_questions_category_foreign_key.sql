@@ -0,0 +1,34 @@
+--
+-- questions.category references categories.id as an integer, and the
+-- category listings, quiz draws and difficulty filters are indexed.
+-- Databases restored from trivia.psql already have the integer column
+-- and the foreign key; databases created by an older models.py stored
+-- the category as text.
+--
+
+BEGIN;
+
+ALTER TABLE public.questions
+    ALTER COLUMN category TYPE integer USING category::integer;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+            SELECT 1 FROM pg_constraint
+            WHERE conrelid = 'public.questions'::regclass
+            AND contype = 'f') THEN
+        ALTER TABLE public.questions
+            ADD CONSTRAINT category FOREIGN KEY (category)
+            REFERENCES public.categories(id)
+            ON UPDATE CASCADE ON DELETE SET NULL;
+    END IF;
+END
+$$;
+
+CREATE INDEX IF NOT EXISTS questions_category_id_idx
+    ON public.questions (category, id);
+
+CREATE INDEX IF NOT EXISTS questions_difficulty_idx
+    ON public.questions (difficulty);
+
+COMMIT;
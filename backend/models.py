@@ -1,8 +1,29 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+import time
+import hashlib
+import threading
+from datetime import datetime
+from sqlalchemy import Column, String, Integer, ForeignKey, Index
+from sqlalchemy import DateTime
+from sqlalchemy import Table
+from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy import select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.pool import NullPool
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 import json
 from config import db_type, db_username, db_password, db_host, db_port, db_name
+from config import db_pool_size, db_max_overflow, db_pool_timeout
+from config import db_pool_recycle, db_pool_pre_ping, db_external_pooler
+from config import db_statement_timeout
+from config import db_keepalives_idle, db_keepalives_interval
+from config import db_keepalives_count
+from config import lazy_db_init
 
 database_path = "{}://{}:{}@{}:{}/{}".format(
     db_type,
@@ -16,16 +37,242 @@ db = SQLAlchemy()
 
 '''
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service, and makes sure the
+    schema exists. With LAZY_DB_INIT = True in the app config the schema
+    check waits for the first request, so that no database round trip
+    happens while the app is created.
 '''
 
 
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config.setdefault(
+        "SQLALCHEMY_ENGINE_OPTIONS", engine_options(database_path))
     db.app = app
     db.init_app(app)
-    db.create_all()
+    app.extensions['pool_metrics'] = watch_pool(db.get_engine(app))
+    app.extensions.pop('schema_version', None)
+
+    if app.config.get('LAZY_DB_INIT', lazy_db_init):
+        app.before_first_request(lambda: create_schema(app))
+    else:
+        create_schema(app)
+
+
+'''
+create_schema(app)
+    creates the missing tables and indexes of the models, unless the
+    schema_version table already holds the fingerprint of the current
+    models: then it costs a single SELECT instead of a catalog lookup per
+    table. The fingerprint is a hash of the CREATE statements, so any
+    change to the models triggers create_all again (which only adds what
+    is missing; it never alters existing tables). Safe to call repeatedly,
+    from several threads and from workers starting together; the time it
+    took is kept in app.extensions['startup_timings']['schema'].
+'''
+schema_version = Table(
+    'schema_version', db.metadata,
+    Column('version', String, primary_key=True))
+
+schema_lock = threading.Lock()
+
+
+def schema_fingerprint(engine):
+    dialect = engine.dialect
+    statements = []
+    for table in db.metadata.sorted_tables:
+        statements.append(str(CreateTable(table).compile(dialect=dialect)))
+        statements.extend(
+            str(CreateIndex(index).compile(dialect=dialect))
+            for index in sorted(table.indexes, key=lambda index: index.name))
+    return hashlib.sha1('\n'.join(statements).encode('utf-8')).hexdigest()
+
+
+'''
+write_schema_version(engine, version)
+    replaces the marker by `version`. Workers booting together after a
+    model change all write it: only other versions are deleted, and a
+    worker losing the race to insert the same version re-reads it instead
+    of failing.
+'''
+
+
+def write_schema_version(engine, version):
+    try:
+        with engine.begin() as connection:
+            connection.execute(schema_version.delete().where(
+                schema_version.c.version != version))
+            connection.execute(schema_version.insert(), version=version)
+    except IntegrityError:
+        with engine.connect() as connection:
+            current = connection.execute(
+                select([schema_version.c.version])).scalar()
+        if current != version:
+            raise
+
+
+def create_schema(app):
+    started = time.perf_counter()
+    with schema_lock:
+        if app.extensions.get('schema_version') is not None:
+            return
+
+        engine = db.get_engine(app)
+        version = schema_fingerprint(engine)
+        try:
+            with engine.connect() as connection:
+                current = connection.execute(
+                    select([schema_version.c.version])).scalar()
+        except DBAPIError:
+            current = None
+
+        if current != version:
+            try:
+                db.create_all(app=app)
+            except DBAPIError:
+                # another worker created the same tables meanwhile
+                db.create_all(app=app)
+            write_schema_version(engine, version)
+
+        app.extensions['schema_version'] = version
+        app.extensions.setdefault('startup_timings', {})['schema'] = \
+            time.perf_counter() - started
+
+
+'''
+engine_options(database_path)
+    SQLAlchemy engine options for the pooling settings of config.py.
+    Only Postgres connections are tuned; SQLite keeps its defaults.
+'''
+
+
+def engine_options(database_path):
+    if not database_path.startswith('postgres'):
+        return {}
+
+    connect_args = {
+        'keepalives': 1,
+        'keepalives_idle': db_keepalives_idle,
+        'keepalives_interval': db_keepalives_interval,
+        'keepalives_count': db_keepalives_count
+        }
+
+    if db_external_pooler:
+        # the pooler owns the connections; startup options such as
+        # statement_timeout are rejected by transaction poolers
+        return {
+            'poolclass': NullPool,
+            'connect_args': connect_args
+            }
+
+    if db_statement_timeout:
+        connect_args['options'] = '-c statement_timeout={}'.format(
+            db_statement_timeout)
+
+    return {
+        'pool_size': db_pool_size,
+        'max_overflow': db_max_overflow,
+        'pool_timeout': db_pool_timeout,
+        'pool_recycle': db_pool_recycle,
+        'pool_pre_ping': db_pool_pre_ping,
+        'connect_args': connect_args
+        }
+
+
+'''
+watch_pool(engine)
+    counts the connection pool events of `engine` and returns the
+    counters, which are also kept in app.extensions['pool_metrics']:
+        connects         new database connections
+        checkouts        connections handed out by the pool
+        checkins         connections given back
+        invalidations    connections dropped after an error
+        checked_out      connections currently handed out
+        checkout_seconds total time connections were held
+'''
+
+
+def watch_pool(engine):
+    metrics = getattr(engine, 'pool_metrics', None)
+    if metrics is not None:
+        return metrics
+
+    metrics = engine.pool_metrics = {
+        'connects': 0,
+        'checkouts': 0,
+        'checkins': 0,
+        'invalidations': 0,
+        'checked_out': 0,
+        'checkout_seconds': 0.0
+        }
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        metrics['connects'] += 1
+
+    @event.listens_for(engine, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics['checkouts'] += 1
+        metrics['checked_out'] += 1
+        connection_record.info['checked_out_at'] = time.monotonic()
+
+    @event.listens_for(engine, 'checkin')
+    def on_checkin(dbapi_connection, connection_record):
+        checked_out_at = connection_record.info.pop('checked_out_at', None)
+        if checked_out_at is None:
+            return
+        metrics['checkins'] += 1
+        metrics['checked_out'] -= 1
+        metrics['checkout_seconds'] += time.monotonic() - checked_out_at
+
+    @event.listens_for(engine, 'invalidate')
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        metrics['invalidations'] += 1
+
+    return metrics
+
+
+'''
+on_question_write(hook)
+    registers hook(action, questions), called after a write to the
+    questions table has been committed. action is 'insert' or 'delete',
+    questions is the list of affected Question rows.
+    Bulk writes call hooks with action 'bulk' and one object per category
+    written to, which has `category` but no `id`; hooks should rebuild
+    whatever they derived from those rows.
+'''
+question_write_hooks = []
+
+
+def on_question_write(hook):
+    question_write_hooks.append(hook)
+    return hook
+
+
+def notify_question_write(action, questions):
+    for hook in question_write_hooks:
+        hook(action, questions)
+
+
+'''
+on_category_write(hook)
+    registers hook(action, category_ids), called after a write to the
+    categories table has been committed, once the cached categories are
+    forgotten. action is 'insert', 'update' or 'delete'.
+'''
+category_write_hooks = []
+
+
+def on_category_write(hook):
+    category_write_hooks.append(hook)
+    return hook
+
+
+def notify_category_write(action, category_ids):
+    forget_categories()
+    for hook in category_write_hooks:
+        hook(action, category_ids)
 
 
 '''
@@ -36,11 +283,19 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        Index('questions_category_id_idx', 'category', 'id'),
+        Index('questions_difficulty_idx', 'difficulty'),
+        )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(
+        Integer,
+        ForeignKey(
+            'categories.id', name='category',
+            onupdate='CASCADE', ondelete='SET NULL'))
     difficulty = Column(Integer)
 
     def __init__(
@@ -53,7 +308,15 @@ class Question(db.Model):
 
     def insert(self):
         db.session.add(self)
+        db.session.flush()
+        # commit expires self; the hooks and callers get a copy so that
+        # they don't reload the row
+        inserted = QuestionRow(
+            self.id, self.question, self.answer, self.category,
+            self.difficulty)
         db.session.commit()
+        notify_question_write('insert', [inserted])
+        return inserted
 
     def update(self):
         db.session.commit()
@@ -61,6 +324,47 @@ class Question(db.Model):
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        notify_question_write('delete', [self])
+
+    def format(self):
+        return {
+            'id': self.id,
+            'question': self.question,
+            'answer': self.answer,
+            'category': self.category,
+            'difficulty': self.difficulty
+            }
+
+
+'''
+QuestionRow
+    read-only question for hot read paths. QuestionRow.query() selects
+    only the question columns as plain tuples, skipping the identity map
+    and attribute instrumentation of Question; rows are formatted the
+    same way. Writes go through Question.
+'''
+
+
+class QuestionRow:
+    __slots__ = ('id', 'question', 'answer', 'category', 'difficulty')
+
+    def __init__(self, id, question, answer, category, difficulty):
+        self.id = id
+        self.question = question
+        self.answer = answer
+        self.category = category
+        self.difficulty = difficulty
+
+    @staticmethod
+    def query(*criteria):
+        return db.session.query(
+            Question.id, Question.question, Question.answer,
+            Question.category, Question.difficulty).filter(*criteria)
+
+    @classmethod
+    def get(cls, question_id):
+        row = cls.query(Question.id == question_id).first()
+        return cls(*row) if row is not None else None
 
     def format(self):
         return {
@@ -72,6 +376,19 @@ class Question(db.Model):
             }
 
 
+'''
+question_changes
+    the log of the ids of written questions, appended by flaskr/store.py
+    when the shared question store is enabled. A row without question_id
+    stands for a bulk write: the store is rebuilt from the table.
+'''
+question_changes = Table(
+    'question_changes', db.metadata,
+    Column('id', Integer, primary_key=True),
+    Column('question_id', Integer),
+    Column('changed_at', DateTime, default=datetime.utcnow))
+
+
 '''
 Category
 
@@ -87,8 +404,71 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        db.session.flush()
+        category_id = self.id
+        db.session.commit()
+        notify_category_write('insert', [category_id])
+
+    def update(self):
+        category_id = self.id
+        db.session.commit()
+        notify_category_write('update', [category_id])
+
+    def delete(self):
+        category_id = self.id
+        db.session.delete(self)
+        db.session.commit()
+        notify_category_write('delete', [category_id])
+
     def format(self):
         return {
             'id': self.id,
             'type': self.type
             }
+
+
+'''
+cached_categories()
+    returns the categories of the application as a dict with
+        categories     {id: type} of every category
+        etag           hash of the categories, for conditional requests
+        last_modified  when this worker first saw the current categories
+    The categories are cached until a category is written through the
+    model, or for CATEGORY_CACHE_SECONDS to pick up writes of other workers.
+'''
+CATEGORY_CACHE_SECONDS = 300
+
+
+def cached_categories():
+    cache = current_app.extensions.get('category_cache')
+    if cache is not None and cache['expires_at'] > time.monotonic():
+        return cache
+
+    categories = dict(
+        db.session.query(Category.id, Category.type)
+        .order_by(Category.id)
+        .all())
+    etag = hashlib.sha1(
+        json.dumps(sorted(categories.items())).encode('utf-8')).hexdigest()
+
+    if cache is not None and cache['etag'] == etag:
+        last_modified = cache['last_modified']
+    else:
+        last_modified = datetime.utcnow().replace(microsecond=0)
+
+    cache = {
+        'categories': categories,
+        'etag': etag,
+        'last_modified': last_modified,
+        'expires_at': time.monotonic() + CATEGORY_CACHE_SECONDS
+        }
+    current_app.extensions['category_cache'] = cache
+    return cache
+
+
+def forget_categories():
+    cache = current_app.extensions.get('category_cache')
+    if cache is not None:
+        cache['expires_at'] = 0
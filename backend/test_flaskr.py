@@ -1,13 +1,27 @@
+import asyncio
+import gzip
+import io
 import os
+import tempfile
+import threading
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+from contextlib import contextmanager
+from contextlib import redirect_stderr
+from unittest import mock
 
 from flaskr import create_app
+from flaskr.asgi import AsgiApp
+from flaskr.bulk import IMPORT_MAX_BATCH_SIZE
+from flaskr.synthetic import QuestionGenerator
+from models import db
 from models import setup_db
+from models import create_schema
+from models import write_schema_version
 from models import Question
 from models import Category
 from sqlalchemy import desc
+from sqlalchemy import event
 from config import db_type
 from config import db_username
 from config import db_password
@@ -20,7 +34,7 @@ class TriviaTestCase(unittest.TestCase):
 
     def setUp(self):
 
-        self.app = create_app()
+        self.app = create_app({'LAZY_DB_INIT': True})
         self.client = self.app.test_client
         self.database_path = "{}://{}:{}@{}:{}/{}".format(
             db_type,
@@ -30,17 +44,36 @@ class TriviaTestCase(unittest.TestCase):
             db_port,
             db_test_name)
         setup_db(self.app, self.database_path)
-
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-
-            self.db.create_all()
+        create_schema(self.app)
 
     def tearDown(self):
 
         pass
 
+    '''
+    query_budget(app, budget)
+        counts the SQL statements `app` runs inside the block and fails
+        the test when there are more than `budget`.
+    '''
+    @contextmanager
+    def query_budget(self, app, budget):
+
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        engine = db.get_engine(app)
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+
+        if len(statements) > budget:
+            self.fail('{} SQL statements, budget is {}:\n{}'.format(
+                len(statements), budget, '\n'.join(statements)))
+
     """
     TODO(Done): Write at least one test for each test
     for successful operation and for expected errors.
@@ -114,6 +147,73 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(
             data['total_questions'] > 0)
 
+    def test_create_questions_batch(self):
+
+        res = self.client().post('/questions', json={'questions': [
+            {'question': 'Batch', 'answer': 'One', 'category': 1,
+             'difficulty': 1},
+            {'question': 'Batch'},
+            {'question': 'Batch', 'answer': 'Two', 'category': 2,
+             'difficulty': 2}]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['created']), 2)
+        self.assertEqual(
+            [result['status'] for result in data['results']],
+            ['created', 'invalid', 'created'])
+        self.assertEqual(data['results'][1]['message'], 'Fill Answer Field')
+
+        with self.app.app_context():
+            self.assertEqual(
+                Question.query.filter(
+                    Question.id.in_(data['created'])).count(), 2)
+
+    def test_create_questions_batch_with_malformed_item(self):
+
+        res = self.client().post('/questions', json={'questions': [
+            {'question': 'Batch', 'answer': 'Valid', 'category': 1,
+             'difficulty': 1},
+            {'question': ['x'], 'answer': 'Malformed', 'category': 1,
+             'difficulty': 1},
+            {'question': 'Batch', 'answer': {'x': 1}, 'category': 1,
+             'difficulty': 1}]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['created']), 1)
+        self.assertEqual(data['results'][1], {
+            'index': 1, 'status': 'invalid',
+            'message': 'Question must be text'})
+        self.assertEqual(data['results'][2]['message'], 'Answer must be text')
+
+    def test_delete_questions_batch(self):
+
+        res = self.client().post('/questions', json={'questions': [
+            {'question': 'Batch', 'answer': 'Delete', 'category': 1,
+             'difficulty': 1}] * 3})
+        created = json.loads(res.data)['created']
+
+        res = self.client().delete(
+            '/questions', json={'ids': created + [0]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deleted'], created)
+        self.assertEqual(data['results'][-1], {'id': 0, 'status': 'not_found'})
+        with self.app.app_context():
+            self.assertEqual(
+                Question.query.filter(Question.id.in_(created)).count(), 0)
+
+    def test_error_400_delete_questions_batch(self):
+
+        res = self.client().delete('/questions', json={'ids': 'all'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(
+            data['message'], 'ids must be a list of question ids')
+
     def test_error_create_question(self):
 
         json_create_question_error = {
@@ -131,6 +231,18 @@ class TriviaTestCase(unittest.TestCase):
             data['message'],
             'Fill Category Field')
 
+    def test_error_create_question_in_unknown_category(self):
+
+        res = self.client().post('/questions', json={
+            'question': 'Is this a test question?',
+            'answer': 'Yes it is!',
+            'category': 999,
+            'difficulty': 1})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['message'], 'Category 999 does not exist')
+
     def test_search_question(self):
 
         json_search_question = {
@@ -149,6 +261,66 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(
             data['total_questions'] > 0)
 
+    def test_search_question_with_number(self):
+
+        with self.app.app_context():
+            question_id = Question(
+                question='Who won in 1966?', answer='England', category=6,
+                difficulty=2).insert().id
+
+        try:
+            res = self.client().post('/questions', json={'searchTerm': 1966})
+            data = json.loads(res.data)
+        finally:
+            with self.app.app_context():
+                Question.query.get(question_id).delete()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(
+            question_id, [question['id'] for question in data['questions']])
+
+    def test_search_question_ignores_case(self):
+
+        res = self.client().post(
+            '/questions',
+            json={'searchTerm': 'TITLE'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(data['total_matches'] > 0)
+        for question in data['questions']:
+            self.assertIn('title', question['question'].lower())
+
+    def test_suggest_questions(self):
+
+        res = self.client().get('/questions/suggest?q=Whose autobio')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('max-age=30', res.headers['Cache-Control'])
+        self.assertTrue(len(data['suggestions']) > 0)
+        for suggestion in data['suggestions']:
+            self.assertIn('autobio', suggestion['question'].lower())
+
+    def test_suggest_questions_follows_writes(self):
+
+        res = self.client().post('/questions', json={
+            'question': 'Which zyzzyva suggestion is this?',
+            'answer': 'Fresh',
+            'category': 1,
+            'difficulty': 1})
+        question_id = json.loads(res.data)['created']
+
+        res = self.client().get('/questions/suggest?q=zyzz')
+        suggested = [suggestion['id'] for suggestion
+                     in json.loads(res.data)['suggestions']]
+        self.client().delete('/questions/{}'.format(question_id))
+        res = self.client().get('/questions/suggest?q=zyzz')
+
+        self.assertEqual(suggested, [question_id])
+        self.assertEqual(json.loads(res.data)['suggestions'], [])
+
     def test_error_404_search_question(self):
 
         json_search_question = {
@@ -164,6 +336,95 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(
             data['message'], 'Question containing "~~~": No Found.')
 
+# ----------------------------------------------------------------------------#
+# Tests for bulk import and export on /questions
+# ----------------------------------------------------------------------------#
+
+    def test_import_questions(self):
+
+        rows = [
+            {'question': 'Imported?', 'answer': 'Yes',
+             'category': 1, 'difficulty': 1},
+            {'question': 'Imported without answer?',
+             'category': 1, 'difficulty': 1},
+            {'question': 'Imported too?', 'answer': 'Yes',
+             'category': '2', 'difficulty': '3'}]
+        body = '\n'.join(json.dumps(row) for row in rows)
+
+        res = self.client().post(
+            '/questions/import',
+            data=body,
+            content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['imported'], 2)
+        self.assertEqual(data['failed'], 1)
+        self.assertEqual(
+            data['errors'], [{'line': 2, 'message': 'Fill Answer Field'}])
+
+    def test_import_questions_rejects_non_text_rows(self):
+
+        rows = [
+            {'question': 'Imported?', 'answer': 'Yes',
+             'category': 1, 'difficulty': 1},
+            {'question': ['x'], 'answer': 'Yes',
+             'category': 1, 'difficulty': 1},
+            {'question': 'Imported?', 'answer': '   ',
+             'category': 1, 'difficulty': 1},
+            {'question': 'Imported too?', 'answer': 'Yes',
+             'category': 2, 'difficulty': 3}]
+
+        res = self.client().post(
+            '/questions/import',
+            data='\n'.join(json.dumps(row) for row in rows),
+            content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['imported'], 2)
+        self.assertEqual(data['errors'], [
+            {'line': 2, 'message': 'Question must be text'},
+            {'line': 3, 'message': 'Answer must be text'}])
+
+    def test_import_questions_bounds_batch_size(self):
+
+        with mock.patch('flaskr.import_questions', return_value={
+                'imported': 0, 'failed': 0, 'errors': []}) as imported:
+            for batch_size in ('1000000000', '0'):
+                self.client().post(
+                    '/questions/import?batch_size=' + batch_size,
+                    data='', content_type='application/x-ndjson')
+
+        self.assertEqual(
+            [call[0][1] for call in imported.call_args_list],
+            [IMPORT_MAX_BATCH_SIZE, 1])
+
+    def test_export_questions(self):
+
+        res = self.client().get('/questions/export?format=csv')
+        lines = res.data.decode('utf-8').splitlines()
+        total_questions = json.loads(
+            self.client().get('/questions').data)['total_questions']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'text/csv')
+        self.assertEqual(lines[0], 'id,question,answer,category,difficulty')
+        self.assertEqual(len(lines) - 1, total_questions)
+
+    def test_synthetic_questions_are_deterministic(self):
+
+        questions = list(QuestionGenerator([1, 2, 3], seed=1).rows(500))
+
+        self.assertEqual(
+            questions, list(QuestionGenerator([1, 2, 3], seed=1).rows(500)))
+        self.assertNotEqual(
+            questions, list(QuestionGenerator([1, 2, 3], seed=2).rows(500)))
+        categories = [question['category'] for question in questions]
+        self.assertTrue(
+            categories.count(1) > categories.count(2) > categories.count(3))
+
 # ----------------------------------------------------------------------------#
 # Tests for POST endpoint on /categories
 # ----------------------------------------------------------------------------#
@@ -214,6 +475,100 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(
             len(data['categories']) > 0)
 
+    def test_get_all_categories_not_modified(self):
+
+        res = self.client().get('/categories')
+        etag = res.headers['ETag']
+
+        res = self.client().get(
+            '/categories', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+
+        with self.app.app_context():
+            category = Category(type='Udacity')
+            category.insert()
+            res = self.client().get(
+                '/categories', headers={'If-None-Match': etag})
+            category.delete()
+
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+        self.assertIn('Udacity', data['categories'].values())
+
+    def test_category_writes_invalidate_cached_questions(self):
+
+        client = self.client()
+        client.get('/questions?page=1')
+
+        with self.app.app_context():
+            category = Category(type='Udacity')
+            category.insert()
+            res = client.get('/questions?page=1')
+            category.delete()
+        after_delete = json.loads(client.get('/questions?page=1').data)
+
+        self.assertIn('Udacity', json.loads(res.data)['categories'].values())
+        self.assertNotIn('Udacity', after_delete['categories'].values())
+
+    def test_get_categories_with_counts(self):
+
+        res = self.client().get('/categories?with_counts=1')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            set(data['question_counts']), set(data['categories']))
+        with self.app.app_context():
+            self.assertEqual(
+                data['question_counts']['1'],
+                Question.query.filter(Question.category == 1).count())
+
+    def test_get_stats_follows_writes(self):
+
+        client = create_app({'RESPONSE_CACHE_SIZE': 0}).test_client()
+        before = json.loads(client.get('/stats').data)
+
+        res = client.post('/questions', json={
+            'question': 'Stats',
+            'answer': 'Histogram',
+            'category': 2,
+            'difficulty': 5})
+        question_id = json.loads(res.data)['created']
+        after = json.loads(client.get('/stats').data)
+        client.delete('/questions/{}'.format(question_id))
+
+        self.assertEqual(after['total_questions'],
+                         before['total_questions'] + 1)
+        self.assertEqual(
+            after['categories']['2']['difficulties'].get('5', 0),
+            before['categories']['2']['difficulties'].get('5', 0) + 1)
+        self.assertEqual(
+            json.loads(client.get('/stats').data)['categories'],
+            before['categories'])
+
+    def test_get_stats_with_null_difficulties(self):
+
+        app = create_app({
+            'RESPONSE_CACHE_SIZE': 0,
+            'JSON_SERIALIZER': 'json',
+            'JSON_SORT_KEYS': True})
+        with app.app_context():
+            question_id = Question(
+                question='Unrated', answer='Unrated', category=2,
+                difficulty=None).insert().id
+
+        try:
+            res = app.test_client().get('/stats')
+            data = json.loads(res.data)
+        finally:
+            with app.app_context():
+                Question.query.get(question_id).delete()
+
+        self.assertEqual(res.status_code, 200)
+        difficulties = data['categories']['2']['difficulties']
+        self.assertEqual(difficulties['null'], 1)
+
     def test_error_405_get_all_categories(self):
 
         res = self.client().patch('/categories')
@@ -242,6 +597,228 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(
             data['total_questions'] > 0)
 
+    def test_get_questions_after_id(self):
+
+        res = self.client().get('/questions?page=1')
+        first_page = json.loads(res.data)
+        self.assertTrue(first_page['next_after_id'])
+
+        res = self.client().get(
+            '/questions?after_id={}'.format(first_page['next_after_id']))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(
+            data['questions'][0]['id'] > first_page['next_after_id'])
+        self.assertEqual(
+            data['total_questions'], first_page['total_questions'])
+
+    def test_get_questions_cache_invalidated_on_create(self):
+
+        res = self.client().get('/questions?page=1')
+        total_questions = json.loads(res.data)['total_questions']
+
+        self.client().post('/questions', json={
+            'question': 'Is this a cached question?',
+            'answer': 'No',
+            'category': '1',
+            'difficulty': 1})
+
+        res = self.client().get('/questions?page=1')
+        data = json.loads(res.data)
+        self.assertEqual(data['total_questions'], total_questions + 1)
+
+    def test_get_questions_from_shared_cache(self):
+
+        class StubBackend(dict):
+            def set(self, key, value, ttl=None):
+                self[key] = value
+
+        backend = StubBackend()
+        client = create_app({'RESPONSE_CACHE_BACKEND': backend}).test_client()
+
+        client.get('/categories/1/questions')
+        cached_pages = [key for key in backend if key.startswith('response:')]
+        self.assertEqual(len(cached_pages), 1)
+
+        backend[cached_pages[0]] = (b'{"cached": true}', 'application/json')
+        res = client.get('/categories/1/questions')
+        self.assertEqual(json.loads(res.data), {'cached': True})
+
+    def test_get_questions_as_columns(self):
+
+        res = self.client().get('/questions?page=1&shape=columns')
+        data = json.loads(res.data)
+        questions = json.loads(
+            self.client().get('/questions?page=1').data)['questions']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            set(data['questions']),
+            {'id', 'question', 'answer', 'category', 'difficulty'})
+        self.assertEqual(
+            data['questions']['id'],
+            [question['id'] for question in questions])
+        self.assertEqual(
+            data['questions']['answer'],
+            [question['answer'] for question in questions])
+
+    def test_compressed_response(self):
+
+        client = create_app({
+            'RESPONSE_CACHE_SIZE': 0,
+            'JSON_SERIALIZER': 'json'}).test_client()
+
+        res = client.get(
+            '/questions?page=1', headers={'Accept-Encoding': 'gzip'})
+        plain = self.client().get('/questions?page=1')
+
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(
+            json.loads(gzip.decompress(res.data)), json.loads(plain.data))
+
+    def test_get_all_questions_streamed(self):
+
+        res = self.client().get('/questions?stream=1')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(len(data['questions']), data['total_questions'])
+
+    def test_get_questions_from_category_as_ndjson(self):
+
+        res = self.client().get(
+            '/categories/1/questions',
+            headers={'Accept': 'application/x-ndjson'})
+        questions = [
+            json.loads(line) for line in res.data.decode('utf-8').splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertTrue(len(questions) > 0)
+        for question in questions:
+            self.assertEqual(question['category'], 1)
+
+    def test_request_metrics(self):
+
+        client = create_app({
+            'INSTRUMENTATION': True,
+            'RESPONSE_CACHE_SIZE': 0}).test_client()
+
+        res = client.get('/questions?page=1')
+        self.assertIn('db;dur=', res.headers['Server-Timing'])
+
+        res = client.get('/metrics')
+        metrics = res.data.decode('utf-8')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(
+            'trivia_requests_total'
+            '{endpoint="/questions",method="GET",status="200"} 1', metrics)
+        self.assertIn(
+            'trivia_db_queries_total{endpoint="/questions"}', metrics)
+        self.assertIn('trivia_startup_seconds{phase="create_app"}', metrics)
+
+    def test_question_store(self):
+
+        quiz = {
+            'previous_questions': [],
+            'quiz_category': {'id': 1, 'type': 'Science'}}
+
+        with tempfile.TemporaryDirectory() as directory:
+            config = {
+                'QUESTION_STORE': os.path.join(directory, 'questions.store'),
+                'QUESTION_STORE_POLL_SECONDS': 3600,
+                'RESPONSE_CACHE_SIZE': 0}
+            app = create_app(config)
+            client = app.test_client()
+            client.get('/questions?page=1')
+            client.post('/quizzes', json=quiz)
+
+            plain = create_app({'RESPONSE_CACHE_SIZE': 0}).test_client()
+            with self.query_budget(app, 0):
+                for path in ('/questions?page=2', '/questions?after_id=12',
+                             '/categories/1/questions'):
+                    data = client.get(path).get_json()
+                    self.assertEqual(
+                        data['questions'],
+                        plain.get(path).get_json()['questions'])
+                    self.assertEqual(
+                        data['next_after_id'],
+                        plain.get(path).get_json()['next_after_id'])
+                data = client.post('/quizzes', json=quiz).get_json()
+                self.assertEqual(data['question']['category'], 1)
+
+            # writes are logged and read back by this and other workers
+            created = client.post('/questions', json={
+                'question': 'Which store is shared by the workers?',
+                'answer': 'The question store',
+                'category': 1,
+                'difficulty': 1}).get_json()['created']
+            other = create_app(dict(config, QUESTION_STORE_POLL_SECONDS=0))
+            path = '/categories/1/questions?after_id={}'.format(created - 1)
+            for worker in (client, other.test_client()):
+                data = worker.get(path).get_json()
+                self.assertEqual(data['questions'][0]['id'], created)
+
+            client.delete('/questions/{}'.format(created))
+            for worker in (client, other.test_client()):
+                res = worker.get(path)
+                self.assertEqual(res.status_code, 404)
+
+    def test_lazy_startup(self):
+
+        app = create_app({'LAZY_DB_INIT': True, 'RESPONSE_CACHE_SIZE': 0})
+        self.assertNotIn('schema_version', app.extensions)
+
+        # setUp wrote the schema marker: the check is a single SELECT
+        with self.query_budget(app, 1):
+            create_schema(app)
+        self.assertIn('schema_version', app.extensions)
+
+        res = app.test_client().get('/categories')
+        self.assertEqual(res.status_code, 200)
+
+    def test_schema_version_written_by_several_workers(self):
+
+        engine = db.get_engine(self.app)
+        version = self.app.extensions['schema_version']
+
+        # a worker that lost the race inserts the marker a second time
+        write_schema_version(engine, 'stale')
+        write_schema_version(engine, version)
+        write_schema_version(engine, version)
+
+        with engine.connect() as connection:
+            self.assertEqual(
+                [row[0] for row in connection.execute(
+                    'SELECT version FROM schema_version')],
+                [version])
+
+    def test_warm_caches(self):
+
+        app = create_app({'WARM_CACHES': True, 'RESPONSE_CACHE_SIZE': 0})
+        app.extensions['warm_thread'].join()
+        self.assertIn('warm', app.extensions['startup_timings'])
+        # SQLite searches through the in-memory index, Postgres in SQL
+        self.assertEqual(
+            'search_index' in app.extensions,
+            db.get_engine(app).dialect.name != 'postgresql')
+
+        client = app.test_client()
+        with self.query_budget(app, 0):
+            client.get('/categories')
+            client.get('/stats')
+            client.get('/questions/suggest?q=wh')
+        with self.query_budget(app, 1):
+            client.post('/quizzes', json={
+                'previous_questions': [],
+                'quiz_category': {'id': 1, 'type': 'Science'}})
+
     def test_error_405_get_all_questions_paginated(
             self):
 
@@ -345,6 +922,204 @@ class TriviaTestCase(unittest.TestCase):
             json_play_quizz
             ['previous_questions'])
 
+    def test_play_quiz_all_categories(self):
+
+        json_play_quizz = {
+            'previous_questions': [],
+            'quiz_category': {
+                'type': 'click',
+                'id': 0
+                }
+            }
+        res = self.client().post(
+            '/quizzes', json=json_play_quizz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(
+            data['question']['question'])
+
+    def test_play_quiz_exhausted_category(self):
+
+        with self.app.app_context():
+            question_ids = [
+                question.id for question in
+                Question.query.filter(Question.category == 1).all()]
+
+        json_play_quizz = {
+            'previous_questions': question_ids,
+            'quiz_category': {
+                'type': 'Science',
+                'id': '1'
+                }
+            }
+        res = self.client().post(
+            '/quizzes', json=json_play_quizz)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['question'], None)
+
+    def test_play_quiz_session(self):
+
+        res = self.client().post(
+            '/quizzes/sessions',
+            json={'quiz_category': {'type': 'Science', 'id': '1'}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        token = data['quiz_session']
+
+        asked = []
+        for _ in range(data['total_questions']):
+            res = self.client().post(
+                '/quizzes/sessions/{}/next'.format(token))
+            question = json.loads(res.data)['question']
+            self.assertEqual(question['category'], 1)
+            asked.append(question['id'])
+        self.assertEqual(len(asked), len(set(asked)))
+
+        res = self.client().post('/quizzes/sessions/{}/next'.format(token))
+        data = json.loads(res.data)
+        self.assertEqual(data['question'], None)
+        self.assertEqual(data['remaining'], 0)
+
+    def test_quiz_session_skips_deleted_questions(self):
+
+        client = self.client()
+        client.post('/quizzes', json={'previous_questions': []})
+        res = client.post('/questions', json={
+            'question': 'Deleted', 'answer': 'Deleted', 'category': 1,
+            'difficulty': 1})
+        client.delete('/questions/{}'.format(json.loads(res.data)['created']))
+
+        res = client.post(
+            '/quizzes/sessions',
+            json={'quiz_category': {'type': 'Science', 'id': '1'}})
+        data = json.loads(res.data)
+        token = data['quiz_session']
+
+        asked = []
+        while True:
+            res = client.post('/quizzes/sessions/{}/next'.format(token))
+            question = json.loads(res.data)['question']
+            if question is None:
+                break
+            asked.append(question['id'])
+        self.assertEqual(len(asked), data['total_questions'])
+
+    def test_play_quiz_prefetch(self):
+
+        with self.app.app_context():
+            previous = [question.id for question in Question.query.limit(2)]
+
+        res = self.client().post('/quizzes', json={
+            'previous_questions': previous,
+            'count': 5})
+        data = json.loads(res.data)
+        ids = [question['id'] for question in data['questions']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(len(set(ids)), 5)
+        self.assertFalse(set(ids) & set(previous))
+        self.assertEqual(data['question'], data['questions'][0])
+
+    def test_error_400_play_quiz_count(self):
+
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [],
+            'count': 1000})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['message'], 'count must be between 1 and 50')
+
+    def test_play_quiz_with_difficulty(self):
+
+        with self.app.app_context():
+            difficulty = Question.query.first().difficulty
+
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [],
+            'difficulty': difficulty})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['difficulty'], difficulty)
+
+    def test_play_adaptive_quiz_session(self):
+
+        with self.app.app_context():
+            hardest = Question.query.order_by(
+                desc(Question.difficulty)).first().difficulty
+
+        res = self.client().post('/quizzes/sessions', json={
+            'adaptive': True,
+            'difficulty': hardest})
+        token = json.loads(res.data)['quiz_session']
+
+        res = self.client().post('/quizzes/sessions/{}/next'.format(token))
+        first = json.loads(res.data)['question']
+        res = self.client().post(
+            '/quizzes/sessions/{}/next'.format(token),
+            json={'correct': False})
+        second = json.loads(res.data)['question']
+
+        self.assertEqual(first['difficulty'], hardest)
+        self.assertTrue(second['difficulty'] < hardest)
+        self.assertNotEqual(second['id'], first['id'])
+
+    def test_play_quiz_with_difficulty_and_null_difficulties(self):
+
+        with self.app.app_context():
+            question = Question(
+                question='Unrated', answer='Unrated', category=1,
+                difficulty=None)
+            question_id = question.insert().id
+            difficulty = Question.query.filter(
+                Question.difficulty.isnot(None)).first().difficulty
+
+        try:
+            res = self.client().post('/quizzes', json={
+                'previous_questions': [],
+                'quiz_category': {'id': 1, 'type': 'Science'},
+                'difficulty': difficulty})
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['question']['difficulty'], difficulty)
+
+            res = self.client().post('/quizzes/sessions', json={
+                'quiz_category': {'id': 1, 'type': 'Science'},
+                'adaptive': True,
+                'difficulty': difficulty})
+            token = json.loads(res.data)['quiz_session']
+            for _ in range(3):
+                res = self.client().post(
+                    '/quizzes/sessions/{}/next'.format(token),
+                    json={'correct': False})
+                self.assertEqual(res.status_code, 200)
+                question = json.loads(res.data)['question']
+                self.assertIsNotNone(question)
+                self.assertIsNotNone(question['difficulty'])
+        finally:
+            with self.app.app_context():
+                Question.query.get(question_id).delete()
+
+    def test_404_quiz_session(self):
+
+        res = self.client().post('/quizzes/sessions/DoesNotExist/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(
+            data['message'],
+            'Quiz session DoesNotExist not found.')
+
     def test_error_400_play_quiz(self):
 
         res = self.client().post('/quizzes')
@@ -369,6 +1144,197 @@ class TriviaTestCase(unittest.TestCase):
             data['message'],
             'Method Not Allowed')
 
+# ----------------------------------------------------------------------------#
+# Tests for the ASGI serving mode, driven with fake receive and send
+# ----------------------------------------------------------------------------#
+
+    def asgi_request(self, wsgi_app, method, path, chunks=(b'',),
+                     headers=(), send=None):
+
+        asgi_app = AsgiApp(wsgi_app, threads=2)
+        path, _, query_string = path.partition('?')
+        scope = {
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': query_string.encode('latin-1'),
+            'headers': [(name.lower().encode('latin-1'),
+                         value.encode('latin-1')) for name, value in headers]}
+        incoming = [
+            {'type': 'http.request', 'body': chunk,
+             'more_body': number < len(chunks) - 1}
+            for number, chunk in enumerate(chunks)]
+        sent = []
+
+        async def receive():
+            if incoming:
+                return incoming.pop(0)
+            return {'type': 'http.disconnect'}
+
+        async def record(message):
+            sent.append(message)
+
+        try:
+            asyncio.run(asgi_app(scope, receive, send or record))
+        finally:
+            asgi_app.executor.shutdown()
+        return sent
+
+    def asgi_response(self, sent):
+
+        self.assertEqual(sent[0]['type'], 'http.response.start')
+        self.assertFalse(sent[-1].get('more_body', False))
+        return sent[0]['status'], b''.join(
+            message['body'] for message in sent[1:])
+
+    def test_asgi_get(self):
+
+        status, body = self.asgi_response(
+            self.asgi_request(self.app.wsgi_app, 'GET', '/categories'))
+        data = json.loads(body)
+
+        self.assertEqual(status, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(len(data['categories']) > 0)
+
+    def test_asgi_post_in_chunks(self):
+
+        status, body = self.asgi_response(self.asgi_request(
+            self.app.wsgi_app, 'POST', '/questions',
+            chunks=(b'{"searchTe', b'rm": "tit', b'le"}'),
+            headers=[('Content-Type', 'application/json')]))
+        data = json.loads(body)
+
+        self.assertEqual(status, 200)
+        self.assertTrue(len(data['questions']) > 0)
+
+    def test_asgi_streamed_ndjson(self):
+
+        sent = self.asgi_request(
+            self.app.wsgi_app, 'GET', '/categories/1/questions',
+            headers=[('Accept', 'application/x-ndjson')])
+        status, body = self.asgi_response(sent)
+        questions = [
+            json.loads(line) for line in body.decode('utf-8').splitlines()]
+
+        self.assertEqual(status, 200)
+        self.assertIn((b'content-type', b'application/x-ndjson'),
+                      sent[0]['headers'])
+        self.assertTrue(sent[1]['more_body'])
+        self.assertTrue(len(questions) > 0)
+        for question in questions:
+            self.assertEqual(question['category'], 1)
+
+    def test_asgi_error_before_start_response(self):
+
+        def broken(environ, start_response):
+            raise RuntimeError('broken')
+
+        with redirect_stderr(io.StringIO()) as errors:
+            status, body = self.asgi_response(
+                self.asgi_request(broken, 'GET', '/'))
+
+        self.assertEqual(status, 500)
+        self.assertIn('RuntimeError: broken', errors.getvalue())
+
+    def test_asgi_client_disconnect(self):
+
+        closed = threading.Event()
+
+        def endless(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            try:
+                while True:
+                    yield b'line\n'
+            finally:
+                closed.set()
+
+        sent = []
+
+        async def send(message):
+            if len(sent) == 2:
+                raise OSError('client went away')
+            sent.append(message)
+
+        with self.assertRaises(OSError):
+            self.asgi_request(endless, 'GET', '/', send=send)
+        # the response is closed once the client is gone
+        self.assertTrue(closed.is_set())
+
+        # a request whose body never arrives is not handled at all
+        called = []
+        self.assertEqual(self.asgi_request(
+            lambda environ, start_response: called.append(environ),
+            'POST', '/', chunks=()), [])
+        self.assertEqual(called, [])
+
+# ----------------------------------------------------------------------------#
+# SQL statements per request, once the in-process caches are warm
+# (responses are not cached, so that the routes themselves are measured)
+# ----------------------------------------------------------------------------#
+
+    def budgeted_client(self):
+
+        app = create_app({'RESPONSE_CACHE_SIZE': 0})
+        client = app.test_client()
+        client.get('/questions')
+        client.get('/categories/1/questions')
+        client.post('/questions', json={'searchTerm': 'title'})
+        client.get('/questions/suggest?q=title')
+        client.post('/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': {'id': 1, 'type': 'Science'}})
+        return app, client
+
+    def test_query_budget_reads(self):
+
+        app, client = self.budgeted_client()
+        budgets = [
+            ('GET', '/questions?page=1', None, 1),
+            ('GET', '/questions?after_id=5', None, 1),
+            ('GET', '/categories', None, 0),
+            ('GET', '/categories?with_counts=1', None, 0),
+            ('GET', '/stats', None, 0),
+            ('GET', '/categories/1/questions', None, 1),
+            ('POST', '/questions', {'searchTerm': 'title'}, 2),
+            ('GET', '/questions/suggest?q=tit', None, 0),
+            ('POST', '/quizzes', {
+                'previous_questions': [],
+                'quiz_category': {'id': 1, 'type': 'Science'}}, 1),
+            ('POST', '/quizzes', {'previous_questions': [], 'count': 10}, 1)]
+
+        for method, url, body, budget in budgets:
+            with self.subTest(method=method, url=url):
+                with self.query_budget(app, budget):
+                    res = client.open(url, method=method, json=body)
+                self.assertEqual(res.status_code, 200)
+
+    def test_query_budget_writes(self):
+
+        app, client = self.budgeted_client()
+
+        with self.query_budget(app, 2):
+            res = client.post('/questions', json={
+                'question': 'Query budget',
+                'answer': 'Three',
+                'category': 1,
+                'difficulty': 1})
+        question_id = json.loads(res.data)['created']
+
+        with self.query_budget(app, 2):
+            res = client.delete('/questions/{}'.format(question_id))
+        self.assertEqual(res.status_code, 200)
+
+        res = client.post('/questions', json={'questions': [{
+            'question': 'Query budget',
+            'answer': 'Batch',
+            'category': 1,
+            'difficulty': 1}] * 20})
+        with self.query_budget(app, 3):
+            res = client.delete('/questions', json={
+                'ids': json.loads(res.data)['created']})
+        self.assertEqual(len(json.loads(res.data)['deleted']), 20)
+
 
 if __name__ == "__main__":
     unittest.main()